@@ -20,45 +20,22 @@ Gy = 326705100207588169780830851305070431844712733806592432759389043357573374824
 #  = 483ada7726a3c4655da4fbfc0e1108a8fd17b448a68554199c47d08ffb10d4b8
 G = (Gx, Gy)
 
-BASE256_CODE_STRING = ''.join([chr(x) for x in range(256)])
-
 
 def isinf(p):
     return p[0] == 0 and p[1] == 0
 
 
 def encode_base256(val, minlen=0):
-    minlen = int(minlen)
-    code_string = BASE256_CODE_STRING
-    result_bytes = bytearray()
-    while val > 0:
-        curcode = code_string[val % 256]
-        result_bytes.insert(0, ord(curcode))
-        val //= 256
-
-    pad_size = minlen - len(result_bytes)
-
-    padding_element = b'\x00'
-    if (pad_size > 0):
-        result_bytes = bytes(bytearray(padding_element * pad_size) + result_bytes)
-
-    return result_bytes
+    # big-endian bytes, at least minlen long
+    return val.to_bytes(max(int(minlen), (val.bit_length() + 7) // 8), 'big')
 
 
 def decode_base256(string):
-    base = 256
-    if base == 16:
-        string = string.lower()
-    result = 0
-    while len(string) > 0:
-        result *= base
-        result += string[0]
-        string = string[1:]
-    return result
+    return int.from_bytes(string, 'big')
 
 
 # Extended Euclidean Algorithm
-def inv(a, n):
+def _inv_euclid(a, n):
     if a == 0:
         return 0
     lm, hm = 1, 0
@@ -70,20 +47,32 @@ def inv(a, n):
     return lm % n
 
 
+def inv(a, n):
+    if a == 0:
+        return 0
+    try:
+        # native modular inverse, python 3.8+
+        return pow(a, -1, n)
+    except (ValueError, TypeError):
+        return _inv_euclid(a, n)
+
+
 def to_jacobian(p):
     o = (p[0], p[1], 1)
     return o
 
 
 def jacobian_double(p):
+    # A == 0 for secp256k1, so the A * Z**4 term is left out
     if not p[1]:
         return (0, 0, 0)
-    ysq = (p[1] ** 2) % P
-    S = (4 * p[0] * ysq) % P
-    M = (3 * p[0] ** 2 + A * p[2] ** 4) % P
-    nx = (M ** 2 - 2 * S) % P
-    ny = (M * (S - nx) - 8 * ysq ** 2) % P
-    nz = (2 * p[1] * p[2]) % P
+    X, Y, Z = p
+    ysq = (Y * Y) % P
+    S = (4 * X * ysq) % P
+    M = (3 * X * X) % P
+    nx = (M * M - 2 * S) % P
+    ny = (M * (S - nx) - 8 * ysq * ysq) % P
+    nz = (2 * Y * Z) % P
     return (nx, ny, nz)
 
 
@@ -111,22 +100,208 @@ def jacobian_add(p, q):
     return (nx, ny, nz)
 
 
+def jacobian_add_affine(p, q):
+    # "mixed" addition: p is jacobian, q is affine (x, y) so Z2 == 1 and
+    # several multiplications drop out
+    if not p[1]:
+        return (q[0], q[1], 1)
+    if not q[1]:
+        return p
+    Z1Z1 = (p[2] * p[2]) % P
+    U2 = (q[0] * Z1Z1) % P
+    S2 = (q[1] * p[2] * Z1Z1) % P
+    if p[0] == U2:
+        if p[1] != S2:
+            return (0, 0, 1)
+        return jacobian_double(p)
+    H = U2 - p[0]
+    R = S2 - p[1]
+    H2 = (H * H) % P
+    H3 = (H * H2) % P
+    U1H2 = (p[0] * H2) % P
+    nx = (R * R - H3 - 2 * U1H2) % P
+    ny = (R * (U1H2 - nx) - p[1] * H3) % P
+    nz = (H * p[2]) % P
+    return (nx, ny, nz)
+
+
 def from_jacobian(p):
     z = inv(p[2], P)
     return ((p[0] * z ** 2) % P, (p[1] * z ** 3) % P)
 
 
+def batch_from_jacobian(points):
+    # convert many jacobian points to affine with just one inversion
+    # (Montgomery's trick); points at infinity are not allowed here
+    prefix = []
+    acc = 1
+    for p in points:
+        prefix.append(acc)
+        acc = (acc * p[2]) % P
+    acc = inv(acc, P)
+    rv = [None] * len(points)
+    for i in range(len(points) - 1, -1, -1):
+        z = (acc * prefix[i]) % P
+        acc = (acc * points[i][2]) % P
+        z2 = (z * z) % P
+        rv[i] = ((points[i][0] * z2) % P, (points[i][1] * z2 * z) % P)
+    return rv
+
+
+# Fixed-base table for G: _G_TABLE[i][d] = d * 16**i * G, as affine points.
+# Any multiple of G is then at most 64 mixed additions and no doublings.
+# Built on first use, takes a few milliseconds.
+WINDOW = 4
+_G_TABLE = None
+
+
+def _build_g_table():
+    global _G_TABLE
+    rows = []
+    base = (Gx, Gy, 1)
+    for i in range(256 // WINDOW):
+        row = [base]
+        for d in range(2, 1 << WINDOW):
+            row.append(jacobian_add(row[-1], base))
+        rows.append(row)
+        base = jacobian_add(row[-1], base)       # 16 * base
+    flat = batch_from_jacobian([p for row in rows for p in row])
+    per = (1 << WINDOW) - 1
+    _G_TABLE = [[None] + flat[i * per:(i + 1) * per] for i in range(len(rows))]
+    return _G_TABLE
+
+
+def jacobian_multiply_g(n):
+    # n * G, result in jacobian coordinates
+    table = _G_TABLE or _build_g_table()
+    n %= N
+    acc = (0, 0, 1)
+    mask = (1 << WINDOW) - 1
+    i = 0
+    while n:
+        d = n & mask
+        if d:
+            acc = jacobian_add_affine(acc, table[i][d])
+        n >>= WINDOW
+        i += 1
+    return acc
+
+
+# secp256k1 endomorphism: LAMBDA * (x, y) == (BETA * x, y). Splitting a scalar
+# into two half-length ones (GLV method) halves the number of doublings.
+BETA = 0x7ae96a2b657c07106e64479eac3434e99cf0497512f58995c1396c28719501ee
+LAMBDA = 0x5363ad4cc05c30e0a5261c028812645a122e22ea20816678df02967c1b23bd72
+_GLV_A1 = 0x3086d221a7d46bcde86c90e49284eb15
+_GLV_B1 = -0xe4437ed6010e88286f547fa90abfe4c3
+_GLV_A2 = 0x114ca50f7a8e2f3f657c1108d9d44cfd8
+_GLV_B2 = _GLV_A1
+
+
+def split_scalar(k):
+    # k == k1 + k2 * LAMBDA (mod N), with k1 and k2 about 128 bits, either can be negative
+    c1 = (_GLV_B2 * k + N // 2) // N
+    c2 = (-_GLV_B1 * k + N // 2) // N
+    k1 = k - c1 * _GLV_A1 - c2 * _GLV_A2
+    k2 = -c1 * _GLV_B1 - c2 * _GLV_B2
+    return k1, k2
+
+
+def wnaf(k, w):
+    # width-w NAF of k, least significant digit first; non-zero digits are odd
+    # and less than 2**(w-1) in size, with at least w-1 zeros between them
+    full = 1 << w
+    half = full >> 1
+    sign = -1 if k < 0 else 1
+    k = abs(k)
+    rv = []
+    while k:
+        if k & 1:
+            d = k & (full - 1)
+            if d >= half:
+                d -= full
+            k -= d
+            rv.append(sign * d)
+        else:
+            rv.append(0)
+        k >>= 1
+    return rv
+
+
+def odd_multiples(a, count):
+    # [a, 3a, 5a, ...] count of them, as affine points; a is affine
+    two = from_jacobian(jacobian_double(to_jacobian(a)))
+    pts = [to_jacobian(a)]
+    for _ in range(count - 1):
+        pts.append(jacobian_add_affine(pts[-1], two))
+    return batch_from_jacobian(pts)
+
+
+def _endo_table(table):
+    # same odd multiples, but of LAMBDA * a
+    return [((BETA * x) % P, y) for x, y in table]
+
+
+# wNAF window width for arbitrary points, and for G (tables built once)
+VAR_WINDOW = 5
+G_WINDOW = 8
+_G_ODD = None
+
+
+def _g_odd_tables():
+    global _G_ODD
+    if _G_ODD is None:
+        t = odd_multiples(G, 1 << (G_WINDOW - 2))
+        _G_ODD = (t, _endo_table(t))
+    return _G_ODD
+
+
+def _glv_terms(tables, k, w):
+    # split k and pair each half with its table: terms for _straus()
+    k1, k2 = split_scalar(k % N)
+    return [(tables[0], wnaf(k1, w)), (tables[1], wnaf(k2, w))]
+
+
+def _straus(terms):
+    acc = (0, 0, 1)
+    for i in range(max(len(d) for _, d in terms) - 1, -1, -1):
+        if acc[1]:
+            acc = jacobian_double(acc)
+        for table, digits in terms:
+            if i >= len(digits):
+                continue
+            d = digits[i]
+            if d > 0:
+                acc = jacobian_add_affine(acc, table[d >> 1])
+            elif d < 0:
+                x, y = table[(-d) >> 1]
+                acc = jacobian_add_affine(acc, (x, P - y))
+    return acc
+
+
 def jacobian_multiply(a, n):
+    # n * a for any point, result in jacobian coordinates
     if a[1] == 0 or n == 0:
         return (0, 0, 1)
+    if n < 0 or n >= N:
+        n %= N
+        if n == 0:
+            return (0, 0, 1)
     if n == 1:
         return a
-    if n < 0 or n >= N:
-        return jacobian_multiply(a, n % N)
-    if (n % 2) == 0:
-        return jacobian_double(jacobian_multiply(a, n // 2))
-    if (n % 2) == 1:
-        return jacobian_add(jacobian_double(jacobian_multiply(a, n // 2)), a)
+    if a[2] == 1 and a[0] == Gx and a[1] == Gy:
+        return jacobian_multiply_g(n)
+    aff = (a[0], a[1]) if a[2] == 1 else from_jacobian(a)
+    table = odd_multiples(aff, 1 << (VAR_WINDOW - 2))
+    return _straus(_glv_terms((table, _endo_table(table)), n, VAR_WINDOW))
+
+
+def jacobian_multiply_add(u1, a, u2):
+    # u1 * G + u2 * a in one pass, for signature checks; a is affine
+    terms = _glv_terms(_g_odd_tables(), u1, G_WINDOW)
+    if u2 % N:
+        table = odd_multiples(a, 1 << (VAR_WINDOW - 2))
+        terms += _glv_terms((table, _endo_table(table)), u2, VAR_WINDOW)
+    return _straus(terms)
 
 
 def fast_multiply(a, n):
@@ -137,6 +312,11 @@ def fast_add(a, b):
     return from_jacobian(jacobian_add(to_jacobian(a), to_jacobian(b)))
 
 
+def fast_tweak_add(a, n):
+    # a + n*G, with single inversion at the end
+    return from_jacobian(jacobian_add_affine(jacobian_multiply_g(n), a))
+
+
 def get_pubkey_format(pub):
     if len(pub) == 65 and pub[0] == 4:
         return 'bin'
@@ -259,8 +439,17 @@ def ecdsa_raw_verify(msghash, vrs, pub):
 
     u1, u2 = z * w % N, r * w % N
     pub = decode_pubkey(pub)
-    x, y = fast_add(fast_multiply(G, u1), fast_multiply(pub, u2))
-    return bool(r == x and ((r % N) != 0 and (s % N) != 0))
+    if not (0 < r < N and 0 < s < N):
+        return False
+    X, Y, Z = jacobian_multiply_add(u1, pub, u2)
+    if not Y:
+        return False
+    # compare x-coord without converting from jacobian: x == X/Z^2
+    zz = (Z * Z) % P
+    if X == (r * zz) % P:
+        return True
+    # rare: x-coord was >= N and reduced to give r
+    return (r + N < P) and X == ((r + N) * zz) % P
 
 
 def ecdsa_verify(msg_digest, sig, pub):
@@ -283,11 +472,9 @@ def ecdsa_raw_recover(msghash, vrs):
     if (alpha - y * y) % P != 0 or not (r % N) or not (s % N):
         raise ValueError("Invalid signature!")
     z = decode_base256(msghash)
-    Gz = jacobian_multiply((Gx, Gy, 1), (N - z) % N)
-    XY = jacobian_multiply((x, y, 1), s)
-    Qr = jacobian_add(Gz, XY)
-    Q = jacobian_multiply(Qr, inv(r, N))
-    Q = from_jacobian(Q)
+    # Q = r^-1 * (s*R - z*G), but with r^-1 folded into scalars: no extra multiply
+    rinv = inv(r, N)
+    Q = from_jacobian(jacobian_multiply_add((N - z) * rinv % N, (x, y), s * rinv % N))
     return Q
 
 
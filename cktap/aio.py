@@ -0,0 +1,209 @@
+#
+# (c) Copyright 2022 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# aio.py
+#
+# asyncio front-end for CKTapCard, so one event loop can drive many cards.
+#
+#
+import time, asyncio, threading
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+from .proto import CKTapCard
+
+class AsyncCKTapCard:
+    #
+    # Same API as CKTapCard, but every method is a coroutine:
+    #
+    #   card = (await find_cards())[0]
+    #   sig = await card.sign_digest(cvc, digest)
+    #
+    # - each card gets one dedicated worker thread which does all the talking
+    #   to its transport (PC/SC reader or emulator socket), so commands to a
+    #   card stay in order (card_nonce!) while other cards work in parallel
+    # - plain values like card_ident, is_tapsigner are read directly
+    #
+    def __init__(self, card, worker=None):
+        # - worker: executor the card was created on, if any; must have one thread
+        assert isinstance(card, CKTapCard)
+        self.card = card
+        self._worker = worker or _new_worker()
+
+    @classmethod
+    async def open(cls, transport):
+        # Wrap a transport; the initial status check is done on the worker thread too
+        card, _ = await _claim(_submit_probe(CKTapCard, transport, wrapper=cls))
+        return card
+
+    def __repr__(self):
+        return '<Async%s' % repr(self.card)[1:]
+
+    async def _run(self, fn, *args, **kws):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._worker, partial(fn, *args, **kws))
+
+    def __getattr__(self, name):
+        # only called for things we don't define: pass thru to the card
+        if name in ('card', '_worker'):
+            raise AttributeError(name)
+        value = getattr(self.card, name)
+        if not callable(value):
+            return value
+
+        async def method(*args, **kws):
+            return await self._run(value, *args, **kws)
+
+        method.__name__ = name
+        return method
+
+    async def send(self, cmd, raise_on_error=True, **args):
+        # see CKTapCard.send()
+        return await self._run(self.card.send, cmd, raise_on_error=raise_on_error, **args)
+
+    async def send_auth(self, cmd, cvc, **args):
+        # see CKTapCard.send_auth()
+        return await self._run(self.card.send_auth, cmd, cvc, **args)
+
+    async def close(self):
+        # release the card and our worker thread
+        try:
+            await self._run(self.card.close)
+        finally:
+            self._worker.shutdown(wait=False)
+
+    async def detach(self):
+        # Stop our worker thread, once it's done, but leave the card open.
+        # - returns the blocking CKTapCard, for use from one thread at a time again
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._worker.shutdown)
+        return self.card
+
+    def _discard(self):
+        # close card without waiting, from any thread; for cards nobody wanted
+        self._worker.submit(self.card.close)
+        self._worker.shutdown(wait=False)
+
+def _new_worker():
+    return ThreadPoolExecutor(max_workers=1, thread_name_prefix='cktap-card')
+
+def _submit_probe(probe, *args, limit=None, wrapper=AsyncCKTapCard):
+    # Start probe(*args), which returns a CKTapCard or None, on a new card worker,
+    # so that one thread does all the I/O for that card from the very start.
+    # - returns concurrent future of (wrapped card or None, time it finished),
+    #   as expected by transport.claim_probes()
+    # - the worker is shut down again if no card comes of it
+    # - limit: semaphore to hold while probing
+    worker = _new_worker()
+
+    def run():
+        if limit:
+            with limit:
+                card = probe(*args)
+        else:
+            card = probe(*args)
+        return (wrapper(card, worker) if card else None), time.monotonic()
+
+    def done(fut):
+        if fut.cancelled() or fut.exception() or not fut.result()[0]:
+            worker.shutdown(wait=False)
+
+    fut = worker.submit(run)
+    fut.add_done_callback(done)
+    return fut
+
+def _release(fut):
+    # done-callback for probes nobody is waiting on anymore: close the card on its worker
+    if fut.cancelled() or fut.exception():
+        return
+    card, _ = fut.result()
+    if card:
+        card._discard()
+
+async def _claim(fut):
+    # Wait for one probe. If we are cancelled meanwhile, the probe carries on
+    # in its thread, and whatever card it finds is released when it's done.
+    try:
+        return await asyncio.wrap_future(fut)
+    except asyncio.CancelledError:
+        fut.add_done_callback(_release)
+        raise
+
+def _simulator_card():
+    from .transport import CKTapUnixTransport
+
+    sim = CKTapUnixTransport.find_simulator()
+    return CKTapCard(sim) if sim else None
+
+def _discard_step(step):
+    # a card claimed for a caller who has since gone away
+    if step.cancelled() or step.exception():
+        return
+    card = step.result()
+    if card:
+        card._discard()
+
+async def _scan(parallel=False, timeout=None, max_workers=None):
+    # Yield cards as they are found; same arguments as transport.find_cards()
+    from .transport import claim_probes, _probe_reader
+
+    loop = asyncio.get_running_loop()
+
+    # emulation running on a Unix socket
+    card, _ = await _claim(_submit_probe(_simulator_card))
+    if card:
+        yield card
+
+    from smartcard.System import readers as get_readers
+    readers = await loop.run_in_executor(None, get_readers)
+    if not readers:
+        raise RuntimeError("No USB card readers found. Need at least one.")
+
+    if not parallel or len(readers) == 1:
+        # one reader at a time
+        for r in readers:
+            card, _ = await _claim(_submit_probe(_probe_reader, r))
+            if card:
+                yield card
+        return
+
+    deadline = None if timeout is None else time.monotonic() + timeout
+    limit = threading.BoundedSemaphore(max_workers or len(readers))
+    claims = claim_probes([_submit_probe(_probe_reader, r, limit=limit) for r in readers],
+                                deadline, _release)
+
+    # claim_probes() blocks while waiting, so step thru it on a thread of its own
+    stepper = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cktap-scan')
+    try:
+        while 1:
+            step = stepper.submit(next, claims, None)
+            try:
+                card = await asyncio.wrap_future(step)
+            except asyncio.CancelledError:
+                step.add_done_callback(_discard_step)
+                raise
+            if card is None:
+                break
+            yield card
+    finally:
+        # runs after any step still in progress; releases cards not yet claimed
+        stepper.submit(claims.close)
+        stepper.shutdown(wait=False)
+
+async def find_cards(**kws):
+    # Find all cards (see transport.find_cards) and return them wrapped for asyncio.
+    # - each card is found and set up on its own worker thread, so event loop is not blocked
+    return [card async for card in _scan(**kws)]
+
+async def find_first(**kws):
+    # Operate on the first card we can find, or None
+    # - accepts same arguments as find_cards()
+    scan = _scan(**kws)
+    try:
+        async for card in scan:
+            return card
+    finally:
+        await scan.aclose()
+
+    return None
+
+# EOF
@@ -1,10 +1,21 @@
 # This work is licensed under a Creative Commons Attribution-NonCommercial-NoDerivatives 4.0 International License
 
-import hashlib
+from hashlib import sha256
+from typing import Iterable, List
 
 
 BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
 
+# character => value, for decoding
+BASE58_MAP = {c: i for i, c in enumerate(BASE58_ALPHABET)}
+
+# Big numbers are converted 10 digits at a time: 58**10 < 2**64, so all
+# per-digit work happens on small ints and only one big-int divmod is
+# needed per chunk. Within a chunk, digits are produced in pairs.
+CHUNK_DIGITS = 10
+CHUNK = 58 ** CHUNK_DIGITS
+BASE58_PAIRS = [a + b for a in BASE58_ALPHABET for b in BASE58_ALPHABET]
+
 
 def hash256(s: bytes) -> bytes:
     """
@@ -13,39 +24,67 @@ def hash256(s: bytes) -> bytes:
     :param s: data
     :return: hashed data
     """
-    return hashlib.sha256(hashlib.sha256(s).digest()).digest()
+    return sha256(sha256(s).digest()).digest()
+
+
+def _encode_int(num: int) -> str:
+    """
+    Base58 digits of a number, without leading zeros ('1').
+
+    :param num: non-negative number
+    :return: base58 digits
+    """
+    pairs = BASE58_PAIRS
+    chunks = []
+    while num:
+        num, chunk = divmod(num, CHUNK)
+        chunk, d4 = divmod(chunk, 3364)
+        chunk, d3 = divmod(chunk, 3364)
+        chunk, d2 = divmod(chunk, 3364)
+        d0, d1 = divmod(chunk, 3364)
+        chunks.append(pairs[d0] + pairs[d1] + pairs[d2] + pairs[d3] + pairs[d4])
+    chunks.reverse()
+    # most significant chunk is zero-padded, drop that
+    return ''.join(chunks).lstrip('1')
 
 
 def encode_base58(data: bytes) -> str:
     """
     Encode base58.
 
-    :param data: data to encode
+    :param data: data to encode (any bytes-like object)
     :return: base58 encoded string
     """
-    count = 0
-    for c in data:
-        if c == 0:
-            count += 1
-        else:
-            break
-    num = int.from_bytes(data, 'big')
-    prefix = '1' * count
-    result = ''
-    while num > 0:
-        num, mod = divmod(num, 58)
-        result = BASE58_ALPHABET[mod] + result
-    return prefix + result
+    data = bytes(data)
+    count = len(data) - len(data.lstrip(b'\x00'))
+    return '1' * count + _encode_int(int.from_bytes(data, 'big'))
 
 
 def encode_base58_checksum(data: bytes) -> str:
     """
     Encode base58 checksum.
 
-    :param data: data to encode
+    :param data: data to encode (any bytes-like object)
     :return: base58 encoded string with checksum
     """
-    return encode_base58(data + hash256(data)[:4])
+    data = bytes(data)
+    return encode_base58(data + sha256(sha256(data).digest()).digest()[:4])
+
+
+def bulk_encode_checksum(items: Iterable[bytes]) -> List[str]:
+    """
+    Encode many values with base58 checksum, ie. for exports.
+
+    :param items: data to encode
+    :return: base58 encoded strings with checksum, in same order
+    """
+    rv = []
+    append = rv.append
+    for data in items:
+        data = bytes(data) + sha256(sha256(data).digest()).digest()[:4]
+        count = len(data) - len(data.lstrip(b'\x00'))
+        append('1' * count + _encode_int(int.from_bytes(data, 'big')))
+    return rv
 
 
 def decode_base58(s: str) -> bytes:
@@ -55,26 +94,24 @@ def decode_base58(s: str) -> bytes:
     :param s: base58 encoded string
     :return: decoded data
     """
+    lookup = BASE58_MAP
     num = 0
-    for c in s:
-        if c not in BASE58_ALPHABET:
-            raise ValueError(
-                "character {} is not valid base58 character".format(c)
-            )
-        num *= 58
-        num += BASE58_ALPHABET.index(c)
-
-    h = hex(num)[2:]
-    h = '0' + h if len(h) % 2 else h
-    res = bytes.fromhex(h)
+    for pos in range(0, len(s), CHUNK_DIGITS):
+        part = s[pos:pos + CHUNK_DIGITS]
+        chunk = 0
+        for c in part:
+            try:
+                chunk = chunk * 58 + lookup[c]
+            except KeyError:
+                raise ValueError(
+                    "character {} is not valid base58 character".format(c)
+                )
+        num = num * (58 ** len(part)) + chunk
+
+    res = num.to_bytes((num.bit_length() + 7) // 8, 'big')
 
     # Add padding back.
-    pad = 0
-    for c in s[:-1]:
-        if c == BASE58_ALPHABET[0]:
-            pad += 1
-        else:
-            break
+    pad = len(s) - len(s.lstrip(BASE58_ALPHABET[0]))
     return b'\x00' * pad + res
 
 
@@ -95,4 +132,3 @@ def decode_base58_checksum(s: str) -> bytes:
             )
         )
     return num_bytes[:-4]
-
@@ -22,6 +22,7 @@
 
 
 from enum import Enum
+from functools import lru_cache
 
 class Encoding(Enum):
     """Enumeration type to list the various supported encodings."""
@@ -31,15 +32,24 @@ class Encoding(Enum):
 CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
 BECH32M_CONST = 0x2bc830a3
 
-def bech32_polymod(values):
-    """Internal function that computes the Bech32 checksum."""
-    generator = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
-    chk = 1
+GENERATOR = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+
+# XOR of the generators selected by each possible 5-bit "top" value.
+POLYMOD_TABLE = [0] * 32
+for _top in range(32):
+    for _i in range(5):
+        if (_top >> _i) & 1:
+            POLYMOD_TABLE[_top] ^= GENERATOR[_i]
+del _top, _i
+
+
+def bech32_polymod(values, chk=1):
+    """Internal function that computes the Bech32 checksum.
+
+    Start from chk to continue an earlier computation."""
+    table = POLYMOD_TABLE
     for value in values:
-        top = chk >> 25
-        chk = (chk & 0x1ffffff) << 5 ^ value
-        for i in range(5):
-            chk ^= generator[i] if ((top >> i) & 1) else 0
+        chk = ((chk & 0x1ffffff) << 5 ^ value) ^ table[chk >> 25]
     return chk
 
 
@@ -48,9 +58,15 @@ def bech32_hrp_expand(hrp):
     return [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
 
 
+@lru_cache(maxsize=16)
+def bech32_hrp_polymod(hrp):
+    """Checksum state after the expanded HRP, same for every address."""
+    return bech32_polymod(bech32_hrp_expand(hrp))
+
+
 def bech32_verify_checksum(hrp, data):
     """Verify a checksum given HRP and converted data characters."""
-    const = bech32_polymod(bech32_hrp_expand(hrp) + data)
+    const = bech32_polymod(data, bech32_hrp_polymod(hrp))
     if const == 1:
         return Encoding.BECH32
     if const == BECH32M_CONST:
@@ -59,9 +75,8 @@ def bech32_verify_checksum(hrp, data):
 
 def bech32_create_checksum(hrp, data, spec):
     """Compute the checksum values given HRP and data."""
-    values = bech32_hrp_expand(hrp) + data
     const = BECH32M_CONST if spec == Encoding.BECH32M else 1
-    polymod = bech32_polymod(values + [0, 0, 0, 0, 0, 0]) ^ const
+    polymod = bech32_polymod(data + [0, 0, 0, 0, 0, 0], bech32_hrp_polymod(hrp)) ^ const
     return [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
 
 
@@ -134,4 +149,36 @@ def encode(hrp, witver, witprog):
     ret = bech32_encode(hrp, [witver] + convertbits(witprog, 8, 5), spec)
     if decode(hrp, ret) == (None, None):
         return None
-    return ret
\ No newline at end of file
+    return ret
+
+
+def encode_p2wpkh_many(hash160s, hrp):
+    """Encode many P2WPKH (segwit v0, 20-byte program) addresses.
+
+    Same result as encode(hrp, 0, h) for each, but skips the generic bit
+    conversion and the decode check; the HRP part of the checksum is
+    only computed once."""
+    table = POLYMOD_TABLE
+    start = bech32_polymod([0], bech32_hrp_polymod(hrp))    # witness version 0
+    prefix = hrp + '1q'
+    rv = []
+    for h in hash160s:
+        if len(h) != 20:
+            raise ValueError("hash160 must be 20 bytes")
+        # 160 bits is exactly 32 symbols of 5 bits
+        num = int.from_bytes(h, 'big')
+        data = [(num >> shift) & 31 for shift in range(155, -5, -5)]
+        chk = start
+        for value in data:
+            chk = ((chk & 0x1ffffff) << 5 ^ value) ^ table[chk >> 25]
+        for _ in range(6):
+            chk = ((chk & 0x1ffffff) << 5) ^ table[chk >> 25]
+        chk ^= 1
+        rv.append(prefix + ''.join([CHARSET[d] for d in data])
+                  + ''.join([CHARSET[(chk >> shift) & 31] for shift in range(25, -5, -5)]))
+    return rv
+
+
+def encode_p2wpkh(hash160, hrp):
+    """Encode one P2WPKH address, see encode_p2wpkh_many."""
+    return encode_p2wpkh_many([hash160], hrp)[0]
\ No newline at end of file
@@ -5,16 +5,28 @@
 #
 
 import hmac
+import struct
 import hashlib
 from io import BytesIO
-from typing import Union, List, Tuple
+from functools import lru_cache
+from collections import OrderedDict
+from typing import Union, List, Tuple, Iterator
 
 from cktap.base58 import decode_base58_checksum, encode_base58_checksum
-from cktap._ecdsa import G, N, isinf, fast_multiply, fast_add, privkey_to_pubkey, encode_pubkey, decode_pubkey, decode_privkey
+from cktap._ecdsa import N, decode_pubkey
 
 
 HARDENED = 2 ** 31
 
+# Default number of derived children each node remembers (LRU), see PubKeyNode.ckd
+CHILD_CACHE_SIZE = 256
+
+# Number of xpub strings whose decoded form is remembered, see PubKeyNode.parse
+PARSE_CACHE_SIZE = 128
+
+# version, depth, parent fingerprint, index, chain code, key
+EXTENDED_KEY = struct.Struct(">LB4sL32s33s")
+
 Prv_or_PubKeyNode = Union["PrvKeyNode", "PubKeyNode"]
 
 
@@ -50,7 +62,7 @@ class PubKeyNode(object):
     mainnet_version: int = 0x0488B21E
 
     __slots__ = (
-        "parent",
+        "path",
         "key",
         "chain_code",
         "depth",
@@ -58,13 +70,18 @@ class PubKeyNode(object):
         "parsed_parent_fingerprint",
         "parsed_version",
         "testnet",
-        "children"
+        "children",
+        "cache_size",
+        "_fingerprint",
+        "_point",
+        "_sec"
     )
 
     def __init__(self, key: bytes, chain_code: bytes, index: int = 0,
                  depth: int = 0, testnet: bool = False,
                  parent: Union["PubKeyNode", "PrvKeyNode"] = None,
-                 parent_fingerprint: bytes = None):
+                 parent_fingerprint: bytes = None,
+                 cache_size: int = CHILD_CACHE_SIZE):
         """
         Initializes Pub/PrvKeyNode.
 
@@ -73,10 +90,19 @@ class PubKeyNode(object):
         :param index: current node derivation index (default=0)
         :param depth: current node depth (default=0)
         :param testnet: whether this node is testnet node (default=False)
-        :param parent: parent node of the current node (default=None)
+        :param parent: parent node of the current node, only its fingerprint
+                       and path are kept, not the node itself (default=None)
         :param parent_fingerprint: fingerprint of parent node (default=None)
+        :param cache_size: how many derived children to remember, 0 to
+                           disable; inherited by children (default=256)
         """
-        self.parent = parent
+        if parent is not None:
+            # derived: remember how we got here, but don't keep parent alive
+            self.path = parent.path + (index,)
+            parent_fingerprint = parent.fingerprint()
+        else:
+            # parsed or master: root of our tree
+            self.path = ()
         self.key = key
         self.chain_code = chain_code
         self.depth = depth
@@ -84,7 +110,13 @@ class PubKeyNode(object):
         self.parsed_parent_fingerprint = parent_fingerprint
         self.parsed_version = None
         self.testnet = testnet
-        self.children = []
+        # index => child node, least recently used first
+        self.children = OrderedDict()
+        self.cache_size = cache_size
+        # computed on first use
+        self._fingerprint = None
+        self._point = None
+        self._sec = None
 
     def __eq__(self, other) -> bool:
         """
@@ -108,18 +140,14 @@ class PubKeyNode(object):
         """
         Gets parent fingerprint.
 
-        If node is parsed from extended key, only parsed parent fingerprint
-        is available. If node is derived, parent fingerprint is calculated
-        from parent node.
+        If node is parsed from extended key, this is the parsed parent
+        fingerprint. If node is derived, it was taken from the parent node
+        at that time.
 
         :return: parent fingerprint
         """
-        if self.parent:
-            fingerprint = self.parent.fingerprint()
-        else:
-            fingerprint = self.parsed_parent_fingerprint
         # in case there is still None here - it is master
-        return fingerprint or b"\x00\x00\x00\x00"
+        return self.parsed_parent_fingerprint or b"\x00\x00\x00\x00"
 
     @property
     def pub_version(self) -> int:
@@ -136,12 +164,10 @@ class PubKeyNode(object):
     def __repr__(self) -> str:
         if self.is_master() or self.is_root():
             return self.mark
-        if self.is_hardened():
-            index = str(self.index - 2**31) + "'"
-        else:
-            index = str(self.index)
-        parent = str(self.parent) if self.parent else self.mark
-        return parent + "/" + index
+        return "/".join([self.mark] + [
+            (str(i - HARDENED) + "'") if i >= HARDENED else str(i)
+            for i in self.path
+        ])
 
     def is_hardened(self) -> bool:
         """Check whether current key node is hardened."""
@@ -149,11 +175,11 @@ class PubKeyNode(object):
 
     def is_master(self) -> bool:
         """Check whether current key node is master node."""
-        return self.depth == 0 and self.index == 0 and self.parent is None
+        return self.depth == 0 and self.index == 0 and not self.path
 
     def is_root(self) -> bool:
-        """Check whether current key node is root (has no parent)."""
-        return self.parent is None
+        """Check whether current key node is root (was not derived here)."""
+        return not self.path
 
     @property
     def public_key(self) -> Tuple[int, int]:
@@ -162,11 +188,18 @@ class PubKeyNode(object):
 
         :return: public key of public key node
         """
-        assert len(self.key) == 33
-        return decode_pubkey(self.key, "bin_compressed")
+        if self._point is None:
+            assert len(self.key) == 33
+            self._point = decode_pubkey(self.key, "bin_compressed")
+        return self._point
 
-    def sec(self):
-        return encode_pubkey(self.public_key, "bin_compressed")
+    def sec(self) -> bytes:
+        """
+        Public key in compressed SEC format; already what we store.
+
+        :return: 33 byte public key
+        """
+        return bytes(self.key)
 
     def fingerprint(self) -> bytes:
         """
@@ -174,45 +207,53 @@ class PubKeyNode(object):
 
         :return: first four bytes of SHA256(RIPEMD160(public key))
         """
-        from cktap.compat import hash160
-        return hash160(self.sec())[:4]
+        if self._fingerprint is None:
+            from cktap.compat import hash160
+            self._fingerprint = bytes(hash160(self.sec())[:4])
+        return self._fingerprint
 
     @classmethod
-    def parse(cls, s: Union[str, bytes, BytesIO],
+    def parse(cls, s: Union[str, bytes, bytearray, memoryview, BytesIO],
               testnet: bool = False) -> Prv_or_PubKeyNode:
         """
         Initializes private/public key node from serialized node or
         extended key.
 
+        Extended public keys given as string are decoded just once, recent
+        ones are remembered (see PARSE_CACHE_SIZE). Every call still gives
+        a new node. Private keys are never cached.
+
         :param s: serialized node or extended key
         :param testnet: whether this node is testnet node
         :return: public/private key node
         """
         if isinstance(s, str):
-            s = BytesIO(decode_base58_checksum(s=s))
-        elif isinstance(s, bytes):
-            s = BytesIO(s)
-        elif isinstance(s, BytesIO):
+            if s[1:4] == "pub":
+                # xpub, tpub, zpub...
+                s = _decode_xpub(s)
+            else:
+                s = decode_base58_checksum(s=s)
+        elif isinstance(s, (bytes, bytearray, memoryview)):
             pass
+        elif isinstance(s, BytesIO):
+            s = s.read(EXTENDED_KEY.size)
         else:
             raise ValueError("has to be bytes, str or BytesIO")
         return cls._parse(s, testnet=testnet)
 
     @classmethod
-    def _parse(cls, s: BytesIO, testnet: bool = False) -> Prv_or_PubKeyNode:
+    def _parse(cls, s: Union[bytes, memoryview], testnet: bool = False) -> Prv_or_PubKeyNode:
         """
         Initializes private/public key node from serialized node buffer.
 
-        :param s: serialized node buffer
+        :param s: serialized node, 78 bytes (or more, rest is ignored)
         :param testnet: whether this node is testnet node (default=False)
         :return: public/private key node
         """
-        version = big_endian_to_int(s.read(4))
-        depth = big_endian_to_int(s.read(1))
-        parent_fingerprint = s.read(4)
-        index = big_endian_to_int(s.read(4))
-        chain_code = s.read(32)
-        key_bytes = s.read(33)
+        if len(s) < EXTENDED_KEY.size:
+            raise ValueError("serialized node too short")
+        version, depth, parent_fingerprint, index, chain_code, key_bytes = \
+                EXTENDED_KEY.unpack_from(s)
         key = cls(
             key=key_bytes,
             chain_code=chain_code,
@@ -231,24 +272,22 @@ class PubKeyNode(object):
         :param version: extended public/private key version (default=None)
         :return: serialized extended public/private key node
         """
-        # 4 byte: version bytes
-        result = int_to_big_endian(version, 4)
-        # 1 byte: depth: 0x00 for master nodes, 0x01 for level-1 derived keys
-        result += int_to_big_endian(self.depth, 1)
-        # 4 bytes: the fingerprint of the parent key (0x00000000 if master key)
-        if self.is_master():
-            result += int_to_big_endian(0x00000000, 4)
-        else:
-            result += self.parent_fingerprint
-        # 4 bytes: child number. This is ser32(i) for i in xi = xpar/i,
-        # with xi the key being serialized. (0x00000000 if master key)
-        result += int_to_big_endian(self.index, 4)
-        # 32 bytes: the chain code
-        result += self.chain_code
-        # 33 bytes: the public key or private key data
-        # (serP(K) for public keys, 0x00 || ser256(k) for private keys)
-        result += key
-        return result
+        return EXTENDED_KEY.pack(
+            # 4 byte: version bytes
+            version,
+            # 1 byte: depth: 0x00 for master nodes, 0x01 for level-1 derived keys
+            self.depth,
+            # 4 bytes: the fingerprint of the parent key (0x00000000 if master key)
+            b"\x00\x00\x00\x00" if self.is_master() else self.parent_fingerprint,
+            # 4 bytes: child number. This is ser32(i) for i in xi = xpar/i,
+            # with xi the key being serialized. (0x00000000 if master key)
+            self.index,
+            # 32 bytes: the chain code
+            self.chain_code,
+            # 33 bytes: the public key or private key data
+            # (serP(K) for public keys, 0x00 || ser256(k) for private keys)
+            key
+        )
 
     def serialize_public(self, version: int = None) -> bytes:
         """
@@ -272,6 +311,35 @@ class PubKeyNode(object):
         """
         return encode_base58_checksum(self.serialize_public(version=version))
 
+    def _cached_child(self, index: int) -> Prv_or_PubKeyNode:
+        """
+        Gets previously derived child, if still cached.
+
+        :param index: derivation index
+        :return: child node or None
+        """
+        child = self.children.get(index)
+        if child is not None:
+            try:
+                self.children.move_to_end(index)
+            except KeyError:
+                # evicted meanwhile by another thread, still a valid result
+                pass
+        return child
+
+    def _remember_child(self, child: Prv_or_PubKeyNode) -> Prv_or_PubKeyNode:
+        """
+        Adds freshly derived child to cache, evicting least recently used.
+
+        :param child: derived child
+        :return: same child
+        """
+        if self.cache_size > 0:
+            self.children[child.index] = child
+            while len(self.children) > self.cache_size:
+                self.children.popitem(last=False)
+        return child
+
     def ckd(self, index: int) -> "PubKeyNode":
         """
         The function CKDpub((Kpar, cpar), i) → (Ki, ci) computes a child
@@ -290,33 +358,39 @@ class PubKeyNode(object):
             the resulting key is invalid, and one should proceed with the next
              value for i.
 
+        Children are cached (see cache_size), so repeated derivations are free.
+
         :param index: derivation index
         :return: derived child
         """
         if index >= HARDENED:
             raise RuntimeError("failure: hardened child for public ckd")
+        child = self._cached_child(index)
+        if child is not None:
+            return child
+        from cktap.compat import CT_pubkey_tweak_add
         I = hmac.new(key=self.chain_code, msg=self.key + int_to_big_endian(index, 4), digestmod=hashlib.sha512).digest()
         IL, IR = I[:32], I[32:]
         if big_endian_to_int(IL) >= N:
-            InvalidKeyError(
+            raise InvalidKeyError(
                 "public key {} is greater/equal to curve order".format(
                     big_endian_to_int(IL)
                 )
             )
-        point = fast_add(fast_multiply(G, decode_privkey(IL, "bin_compressed")), self.public_key)
-        if isinf(point):
+        try:
+            Ki = CT_pubkey_tweak_add(self.key, IL)
+        except ValueError:
             raise InvalidKeyError("public key is a point at infinity")
-        Ki = encode_pubkey(point, "bin_compressed")
         child = self.__class__(
             key=Ki,
             chain_code=IR,
             index=index,
             depth=self.depth + 1,
             testnet=self.testnet,
-            parent=self
+            parent=self,
+            cache_size=self.cache_size
         )
-        self.children.append(child)
-        return child
+        return self._remember_child(child)
 
     def generate_children(self, interval: tuple = (0, 20)
                           ) -> List[Prv_or_PubKeyNode]:
@@ -329,6 +403,45 @@ class PubKeyNode(object):
         """
         return [self.ckd(index=i) for i in range(*interval)]
 
+    def iter_addresses(self, branch: int, start: int = 0, count: int = 20,
+                       testnet: bool = None) -> Iterator[Tuple[int, bytes, str]]:
+        """
+        Generates P2WPKH addresses for children of one branch, lazily.
+
+        Walks self/branch/start .. self/branch/(start+count-1), for example
+        branch 0 for receive and 1 for change addresses. Much cheaper than
+        ckd() for each: the HMAC key and serP(K) of the branch are set up
+        once, and no child nodes are created (or cached).
+
+        Indexes which give an invalid key (see ckd) are skipped.
+
+        :param branch: non-hardened index below current node
+        :param start: first child index (default=0)
+        :param count: number of indexes to try (default=20)
+        :param testnet: tb1 addresses instead of bc1 (default=node's testnet)
+        :return: iterator of (index, compressed pubkey, address)
+        """
+        from cktap.compat import hash160, CT_pubkey_tweak_add
+        from cktap.bech32 import encode_p2wpkh
+
+        if start + count > HARDENED:
+            raise ValueError("address index would be hardened")
+        hrp = "tb" if (self.testnet if testnet is None else testnet) else "bc"
+
+        node = self.ckd(index=branch)
+        parent_key = node.sec()
+        # HMAC state after Key=c and Data=serP(K), copied for each index
+        base = hmac.new(key=node.chain_code, msg=parent_key, digestmod=hashlib.sha512)
+
+        for index in range(start, start + count):
+            h = base.copy()
+            h.update(index.to_bytes(4, "big"))
+            try:
+                pubkey = CT_pubkey_tweak_add(parent_key, h.digest()[:32])
+            except ValueError:
+                continue
+            yield index, pubkey, encode_p2wpkh(hash160(pubkey), hrp)
+
     def get_extended_pubkey_from_path(self, index_list: List[int]) -> Prv_or_PubKeyNode:
         """
         Derives node from current node.
@@ -355,7 +468,20 @@ class PrvKeyNode(PubKeyNode):
 
         :return: public key of public key node
         """
-        return fast_multiply(G, big_endian_to_int(self.key))
+        if self._point is None:
+            self._point = decode_pubkey(self.sec(), "bin_compressed")
+        return self._point
+
+    def sec(self) -> bytes:
+        """
+        Public key in compressed SEC format, computed by crypto backend.
+
+        :return: 33 byte public key
+        """
+        if self._sec is None:
+            from cktap.compat import CT_priv_to_pubkey
+            self._sec = bytes(CT_priv_to_pubkey(self.key[-32:]))
+        return self._sec
 
     @property
     def prv_version(self) -> int:
@@ -445,9 +571,15 @@ class PrvKeyNode(PubKeyNode):
             and one should proceed with the next value for i.
             (Note: this has probability lower than 1 in 2**127.)
 
+        Children are cached (see cache_size), so repeated derivations are free.
+
         :param index: derivation index
         :return: derived child
         """
+        child = self._cached_child(index)
+        if child is not None:
+            return child
+        from cktap.compat import CT_privkey_tweak_add
         if index >= HARDENED:
             # hardened
             if len(self.key) < 33:
@@ -457,27 +589,37 @@ class PrvKeyNode(PubKeyNode):
                 key = self.key
             data = key + int_to_big_endian(index, 4)
         else:
-            data = privkey_to_pubkey(self.key) + int_to_big_endian(index, 4)
+            data = self.sec() + int_to_big_endian(index, 4)
         I = hmac.new(key=self.chain_code, msg=data, digestmod=hashlib.sha512).digest()
         IL, IR = I[:32], I[32:]
         if big_endian_to_int(IL) >= N:
-            InvalidKeyError(
+            raise InvalidKeyError(
                 "private key {} is greater/equal to curve order".format(
                     big_endian_to_int(IL)
                 )
             )
-        ki = (int.from_bytes(IL, "big") +
-              big_endian_to_int(self.key)) % N
-        if ki == 0:
-            InvalidKeyError("private key is zero")
+        try:
+            ki = CT_privkey_tweak_add(self.key[-32:], IL)
+        except ValueError:
+            raise InvalidKeyError("private key is zero")
         child = self.__class__(
-            key=int_to_big_endian(ki, 32),
+            key=bytes(ki),
             chain_code=IR,
             index=index,
             depth=self.depth + 1,
             testnet=self.testnet,
-            parent=self
+            parent=self,
+            cache_size=self.cache_size
         )
-        self.children.append(child)
-        return child
+        return self._remember_child(child)
+
 
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def _decode_xpub(s: str) -> bytes:
+    """
+    Base58 decodes extended public key, remembering recent answers.
+
+    :param s: extended public key
+    :return: serialized node
+    """
+    return decode_base58_checksum(s=s)
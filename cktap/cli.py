@@ -650,21 +650,25 @@ def setup_slot(cvc=None, chain_code=None, new_chain_code=True):
 @click.argument('cvc', type=str, metavar="(6-digit code)", required=False)
 def show_balance(cvc):
     "[SC] Show the balance held on all slots"
-    from cktap.sweep import UTXOList
+    from cktap.sweep import UTXOList, fetch_all
 
     card = get_card(only_satscard=True)
     cleanup_cvc(card, cvc, missing_ok=True)
 
-    click.echo('%-42s | Balance' % 'Address')
-    click.echo(('-'*42) + '-+-------------')
-
+    # read all addresses from card first, then query them all at once
+    lists = []
     for slot in range(card.active_slot+1):
         addr = card.get_address(slot=slot, faster=True)
         if addr:
-            b = UTXOList(addr)
-            b.fetch()
-            bal = b.balance()
-            click.echo(f'{addr:40} | {bal}')
+            lists.append(UTXOList(addr, slot_num=slot))
+
+    fetch_all(lists)
+
+    click.echo('%-42s | Balance' % 'Address')
+    click.echo(('-'*42) + '-+-------------')
+
+    for b in lists:
+        click.echo(f'{b.addr:40} | {b.balance()}')
             
 
 @main.command('core')
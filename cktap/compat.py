@@ -15,82 +15,202 @@
 
 __all__ = [ 'sha256s', 'hash160', 
             'CT_ecdh', 'CT_sig_verify', 'CT_sig_to_pubkey', 'CT_sign',
-            'CT_pick_keypair', 'CT_bip32_derive', 'CT_priv_to_pubkey']
+            'CT_pick_keypair', 'CT_bip32_derive', 'CT_priv_to_pubkey',
+            'CT_pubkey_tweak_add', 'CT_privkey_tweak_add',
+            'set_backend', 'get_backend']
 
-# Fall-back code, might be overriden below.
+import os, importlib
+
+# Backends we know, in order of preference.
+BACKENDS = {
+    'pysecp256k1': 'cktap.wrap_pysecp',     # <https://github.com/scgbckbone/python-secp256k1>
+    'wally': 'cktap.wrap_wally',            # <https://wally.readthedocs.io/en/release_0.8.3/crypto/>
+    'coincurve': 'cktap.wrap_coincurve',    # <https://ofek.dev/coincurve/api/>
+    'ecdsa': 'cktap.wrap_ecdsa',            # pure python, always works
+}
+
+_FUNCS = [ 'sha256s', 'hash160', 'CT_ecdh', 'CT_sig_verify', 'CT_sig_to_pubkey', 'CT_sign',
+            'CT_pick_keypair', 'CT_bip32_derive', 'CT_priv_to_pubkey',
+            'CT_pubkey_tweak_add', 'CT_privkey_tweak_add' ]
+
+# function name => (backend name, implementation), see set_backend()
+_active = {}
+_backend = None
+
+# Fall-back code, used when a backend doesn't provide these.
 #
-def sha256s(msg):
+from hashlib import sha256 as _sha256
+
+def _pick_ripemd160():
+    # Find fastest RIPEMD-160 available: OpenSSL (via hashlib) may not
+    # offer it (OpenSSL 3 moved it to "legacy" provider), then wally, then pure python
+    import hashlib
+    try:
+        hashlib.new('ripemd160', b'')
+        return 'hashlib', lambda msg: hashlib.new('ripemd160', msg).digest()
+    except ValueError:
+        pass
+
+    try:
+        from wallycore import ripemd160 as wally_ripemd160
+        return 'wally', lambda msg: bytes(wally_ripemd160(msg))
+    except ImportError:
+        pass
+
+    from .ripemd import ripemd160
+    return 'python', ripemd160
+
+RIPEMD160_SOURCE, ripemd160 = _pick_ripemd160()
+
+def _builtin_sha256s(msg):
     # single-shot SHA256
-    from hashlib import sha256
-    return sha256(msg).digest()
+    return _sha256(msg).digest()
 
-def hash160(x):
+def _builtin_hash160(x):
     # classic bitcoin nested hashes
-    from .ripemd import ripemd160
-    return ripemd160(sha256s(x))
+    return ripemd160(_sha256(x).digest())
+
+_BUILTINS = dict(sha256s=_builtin_sha256s, hash160=_builtin_hash160)
 
-# Other codes must be implemented elsewhere...
+# Public API: each call goes to currently selected backend, so other modules
+# can import these once, and still follow a later set_backend().
 #
+def sha256s(msg):
+    # single-shot SHA256
+    return _active['sha256s'][1](msg)
+
+def hash160(x):
+    # classic bitcoin nested hashes: ripemd160(sha256(x))
+    return _active['hash160'][1](x)
 
 def CT_pick_keypair():
     # return (priv, pub)
-    raise NotImplementedError
+    return _active['CT_pick_keypair'][1]()
 
 def CT_priv_to_pubkey(pk):
     # return compressed pubkey
-    raise NotImplementedError
+    return _active['CT_priv_to_pubkey'][1](pk)
 
 def CT_sig_verify(pub, msg_digest, sig):
     # returns True or False
-    assert len(sig) == 64
-    raise NotImplementedError
+    return _active['CT_sig_verify'][1](pub, msg_digest, sig)
 
 def CT_sig_to_pubkey(msg_digest, sig):
     # returns a pubkey (33 bytes)
-    assert len(sig) == 65
-    raise NotImplementedError
+    return _active['CT_sig_to_pubkey'][1](msg_digest, sig)
 
 def CT_ecdh(his_pubkey, my_privkey):
     # returns a 32-byte session key, which is sha256s(compressed point)
-    raise NotImplementedError
+    return _active['CT_ecdh'][1](his_pubkey, my_privkey)
 
 def CT_sign(privkey, msg_digest, recoverable=False):
-    # returns 64-byte sig
-    raise NotImplementedError
+    # returns 64-byte sig (65 if recoverable)
+    return _active['CT_sign'][1](privkey, msg_digest, recoverable=recoverable)
 
 def CT_bip32_derive(chain_code, master_priv_pub, subkey_path):
     # return pubkey (33 bytes)
-    raise NotImplementedError
-
-
-try:
-    # python-secp256k1 <https://github.com/scgbckbone/python-secp256k1>
-    from cktap.wrap_pysecp import CT_pick_keypair, CT_bip32_derive, CT_priv_to_pubkey
-    from cktap.wrap_pysecp import CT_ecdh, CT_sig_verify, CT_sig_to_pubkey, CT_sign
-
-except ImportError:
-    try:
-        # Wally Core <https://wally.readthedocs.io/en/release_0.8.3/crypto/>
-        import wallycore
-
-        from cktap.wrap_wally import hash160, sha256s
-        from cktap.wrap_wally import CT_ecdh, CT_sig_verify, CT_sig_to_pubkey, CT_sign
-        from cktap.wrap_wally import CT_pick_keypair, CT_bip32_derive, CT_priv_to_pubkey
-
-    except ImportError:
-        try:
-            # Coincurve <https://ofek.dev/coincurve/api/>
-            import coincurve
-
-            from cktap.wrap_coincurve import CT_ecdh, CT_sig_verify, CT_sig_to_pubkey, CT_sign
-            from cktap.wrap_coincurve import CT_pick_keypair, CT_bip32_derive, CT_priv_to_pubkey
-
-        except ImportError:
-            # python ECDSA
+    return _active['CT_bip32_derive'][1](chain_code, master_priv_pub, subkey_path)
+
+def CT_pubkey_tweak_add(pubkey, tweak):
+    # returns pubkey + tweak*G (33 bytes); ValueError if tweak >= N or result is infinity
+    return _active['CT_pubkey_tweak_add'][1](pubkey, tweak)
+
+def CT_privkey_tweak_add(privkey, tweak):
+    # returns (privkey + tweak) mod N (32 bytes); ValueError if tweak >= N or result is zero
+    return _active['CT_privkey_tweak_add'][1](privkey, tweak)
+
+def _load(name):
+    # import the wrapper module for a backend; ImportError if not installed
+    if name not in BACKENDS:
+        raise ValueError("Unknown crypto backend: %r (choose from: %s)"
+                                % (name, ', '.join(BACKENDS)))
+    return importlib.import_module(BACKENDS[name])
+
+def set_backend(name=None, **overrides):
+    #
+    # Pick the crypto library to use, at runtime.
+    #
+    # - name: one of BACKENDS, or None for the first one that is installed
+    # - overrides: per-function choice, for example:
+    #       set_backend('pysecp256k1', hash160='wally')
+    #   use 'builtin' for our own sha256s/hash160
+    # - functions a backend doesn't provide come from the next backend in
+    #   order of preference (or builtin)
+    # - raises ImportError if a requested backend isn't installed
+    #
+    global _backend
+
+    for fn in overrides:
+        if fn not in _FUNCS:
+            raise ValueError("Unknown crypto function: %r" % fn)
+
+    if name is None:
+        for name in BACKENDS:
             try:
-                from cktap.wrap_ecdsa import CT_ecdh, CT_sig_verify, CT_sig_to_pubkey, CT_sign
-                from cktap.wrap_ecdsa import CT_pick_keypair, CT_bip32_derive, CT_priv_to_pubkey
+                main = _load(name)
+                break
             except ImportError:
-                raise RuntimeError("need a crypto library")
+                continue
+        else:
+            raise RuntimeError("need a crypto library")
+    else:
+        main = _load(name)
+
+    new = {}
+    for fn in _FUNCS:
+        want = overrides.get(fn)
+        if want == 'builtin' and fn in _BUILTINS:
+            new[fn] = ('builtin', _BUILTINS[fn])
+        elif want:
+            mod = _load(want)
+            if not hasattr(mod, fn):
+                raise ValueError("Backend %s does not provide %s" % (want, fn))
+            new[fn] = (want, getattr(mod, fn))
+        elif hasattr(main, fn):
+            new[fn] = (name, getattr(main, fn))
+        elif fn in _BUILTINS:
+            new[fn] = ('builtin', _BUILTINS[fn])
+        else:
+            # fall back to another installed backend
+            for other in BACKENDS:
+                try:
+                    mod = _load(other)
+                except ImportError:
+                    continue
+                if hasattr(mod, fn):
+                    new[fn] = (other, getattr(mod, fn))
+                    break
+            else:
+                raise RuntimeError("no crypto library provides " + fn)
+
+    # only now, so a failure above leaves the previous selection in place
+    _active.update(new)
+    _backend = name
+
+def get_backend(fn=None):
+    # Name of backend in use, or which backend (or 'builtin') provides function fn
+    if fn is None:
+        return _backend
+    if fn not in _active:
+        raise ValueError("Unknown crypto function: %r" % fn)
+    return _active[fn][0]
+
+def _from_env(value):
+    # CKTAP_CRYPTO_BACKEND="wally" or "pysecp256k1,hash160=wally"
+    parts = [p.strip() for p in value.split(',') if p.strip()]
+    name = None
+    overrides = {}
+    for p in parts:
+        if '=' in p:
+            fn, be = p.split('=', 1)
+            overrides[fn.strip()] = be.strip()
+        else:
+            name = p
+    set_backend(name, **overrides)
+
+if os.environ.get('CKTAP_CRYPTO_BACKEND'):
+    _from_env(os.environ['CKTAP_CRYPTO_BACKEND'])
+else:
+    set_backend()
 
 # EOF
@@ -10,14 +10,24 @@ INPUT_CHARSET = "0123456789()[],'/*abcdefgh@:$%{}IJKLMNOPQRSTUVWXYZ&+-.;<=>?!^_|
 CHECKSUM_CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
 GENERATOR = [0xf5dee51989, 0xa9fdca3312, 0x1bab10e32d, 0x3706b1677a, 0x644d626ffd]
 
-def descsum_polymod(symbols):
-    """Internal function that computes the descriptor checksum."""
-    chk = 1
+# Character => position in INPUT_CHARSET
+INPUT_MAP = {c: i for i, c in enumerate(INPUT_CHARSET)}
+
+# XOR of the generators selected by each possible 5-bit "top" value
+POLYMOD_TABLE = [0] * 32
+for _top in range(32):
+    for _i in range(5):
+        if (_top >> _i) & 1:
+            POLYMOD_TABLE[_top] ^= GENERATOR[_i]
+del _top, _i
+
+def descsum_polymod(symbols, chk=1):
+    """Internal function that computes the descriptor checksum.
+
+    Start from chk to continue an earlier computation."""
+    table = POLYMOD_TABLE
     for value in symbols:
-        top = chk >> 35
-        chk = (chk & 0x7ffffffff) << 5 ^ value
-        for i in range(5):
-            chk ^= GENERATOR[i] if ((top >> i) & 1) else 0
+        chk = ((chk & 0x7ffffffff) << 5 ^ value) ^ table[chk >> 35]
     return chk
 
 def descsum_expand(s):
@@ -25,9 +35,9 @@ def descsum_expand(s):
     groups = []
     symbols = []
     for c in s:
-        if not c in INPUT_CHARSET:
+        v = INPUT_MAP.get(c)
+        if v is None:
             return None
-        v = INPUT_CHARSET.find(c)
         symbols.append(v & 31)
         groups.append(v >> 5)
         if len(groups) == 3:
@@ -39,11 +49,62 @@ def descsum_expand(s):
         symbols.append(groups[0] * 3 + groups[1])
     return symbols
 
+class DescriptorChecksum:
+    """Incremental descriptor checksum: feed text with update(), in any pieces.
+
+    Use copy() to compute checksums of many descriptors sharing a prefix."""
+
+    __slots__ = ('_chk', '_groups', '_count')
+
+    def __init__(self, s=''):
+        self._chk = 1           # polymod state
+        self._groups = 0        # pending group value, of up to 2 characters
+        self._count = 0         # number of characters in pending group
+        if s:
+            self.update(s)
+
+    def update(self, s):
+        """Add more text; ValueError for characters not allowed in descriptors."""
+        table = POLYMOD_TABLE
+        lookup = INPUT_MAP
+        chk, groups, count = self._chk, self._groups, self._count
+        for c in s:
+            v = lookup.get(c)
+            if v is None:
+                raise ValueError("Invalid character in descriptor: %r" % c)
+            chk = ((chk & 0x7ffffffff) << 5 ^ (v & 31)) ^ table[chk >> 35]
+            groups = groups * 3 + (v >> 5)
+            count += 1
+            if count == 3:
+                chk = ((chk & 0x7ffffffff) << 5 ^ groups) ^ table[chk >> 35]
+                groups = count = 0
+        self._chk, self._groups, self._count = chk, groups, count
+        return self
+
+    def copy(self):
+        rv = DescriptorChecksum.__new__(DescriptorChecksum)
+        rv._chk, rv._groups, rv._count = self._chk, self._groups, self._count
+        return rv
+
+    def checksum(self):
+        """The 8 character checksum of text so far; more can still be added after."""
+        tail = [self._groups] if self._count else []
+        checksum = descsum_polymod(tail + [0, 0, 0, 0, 0, 0, 0, 0], self._chk) ^ 1
+        return ''.join(CHECKSUM_CHARSET[(checksum >> (5 * (7 - i))) & 31] for i in range(8))
+
 def descsum_create(s):
     """Add a checksum to a descriptor without"""
-    symbols = descsum_expand(s) + [0, 0, 0, 0, 0, 0, 0, 0]
-    checksum = descsum_polymod(symbols) ^ 1
-    return s + '#' + ''.join(CHECKSUM_CHARSET[(checksum >> (5 * (7 - i))) & 31] for i in range(8))
+    return s + '#' + DescriptorChecksum(s).checksum()
+
+def descsum_create_many(descriptors, prefix=''):
+    """Add checksums to many descriptors, each of them prefix + item.
+
+    Work for the common prefix is only done once."""
+    base = DescriptorChecksum(prefix)
+    rv = []
+    for d in descriptors:
+        rv.append(prefix + d + '#' + base.copy().update(d).checksum())
+    return rv
 
 def descsum_check(s, require=True):
     """Verify that the checksum is correct in a descriptor"""
@@ -53,7 +114,10 @@ def descsum_check(s, require=True):
         return False
     if not all(x in CHECKSUM_CHARSET for x in s[-8:]):
         return False
-    symbols = descsum_expand(s[:-9]) + [CHECKSUM_CHARSET.find(x) for x in s[-8:]]
+    symbols = descsum_expand(s[:-9])
+    if symbols is None:
+        return False
+    symbols += [CHECKSUM_CHARSET.find(x) for x in s[-8:]]
     return descsum_polymod(symbols) == 1
 
 def drop_origins(s):
@@ -6,6 +6,8 @@
 # Implement the higher-level protocol for cards, both TAPSIGNER and SATSCARD.
 #
 #
+import time
+from collections import namedtuple
 from .bip32 import PubKeyNode
 from cktap.utils import *
 from cktap.constants import *
@@ -13,6 +15,9 @@ from cktap.exceptions import CardRuntimeError
 from cktap.compat import hash160, CT_sig_verify
 from cktap.base58 import encode_base58_checksum
 
+# result from CKTapCard.sign_digests(): 65-byte recoverable sig, and seconds spent on it
+SignResult = namedtuple('SignResult', 'sig elapsed')
+
 class CKTapCard:
     #
     # Protocol/wrapper for cards. Call methods on this instance to get work done.
@@ -20,8 +25,22 @@ class CKTapCard:
     # MAYBE: split into TAPSIGNER vs. SATSCARD subclasses and then some methods
     # which aren't appropriate would not exist in the instance. Seems pointless.
     #
-    def __init__(self, transport):
+
+    # Commands which never change what 'status' would report (other than card_nonce,
+    # which we track anyway). Anything else, or any error, forgets our cached status.
+    STATUS_SAFE_CMDS = frozenset({'status', 'read', 'certs', 'check', 'nfc', 'xpub', 'dump'})
+
+    def __init__(self, transport, cache_status=True):
         self.tr = transport
+
+        # Remember last 'status' response, to save round-trips in the helpers
+        # below. Set False to always ask the card.
+        self.cache_status = cache_status
+        self._last_status = None
+
+        # optional: see start_key_pool()
+        self.key_pool = None
+
         self.first_look()
 
     def __repr__(self):
@@ -31,9 +50,18 @@ class CKTapCard:
 
     def close(self):
         # optional? cleanup connection
+        if self.key_pool:
+            self.key_pool.close()
+            self.key_pool = None
         self.tr.close()
         del self.tr
 
+    def start_key_pool(self, size=4):
+        # Pre-compute ephemeral keys (and ECDH) for auth'ed commands in background,
+        # so send_auth() has less work to do on the critical path.
+        if not self.key_pool:
+            self.key_pool = SessionKeyPool(self.card_pubkey, size=size)
+
     def send(self, cmd, raise_on_error=True, **args):
         # Send a command, get response, but also catch some card state
         # changes and mirror them in our state.
@@ -54,6 +82,12 @@ class CKTapCard:
             # - only changes when "consumed" by commands that need CVC
             self.card_nonce = resp['card_nonce']
 
+        if cmd == 'status' and 'error' not in resp:
+            self._last_status = dict(resp)
+        elif (cmd not in self.STATUS_SAFE_CMDS) or ('error' in resp):
+            # card state may have changed; next helper will ask again
+            self._last_status = None
+
         if raise_on_error and 'error' in resp:
             msg = resp.pop('error')
             code = resp.pop('code', 500)
@@ -95,14 +129,20 @@ class CKTapCard:
         # normal cases too
         self._certs_checked = bool(self.tr.is_emulator)
 
-    def send_auth(self, cmd, cvc, **args):
+    def send_auth(self, cmd, cvc, session=None, **args):
         # Take CVC and do ECDH crypto and provide the CVC in encrypted form
         # - returns session key and usual auth arguments needed
         # - skip if CVC is None and just do normal stuff (optional auth on some cmds)
         # - for commands w/ encrypted arguments, you must provide to this function
+        # - session: reuse (session_key, epubkey) from calc_session_key(), only
+        #   allowed when repeating the same command
 
         if cvc:
-            session_key, auth_args = calc_xcvc(cmd, self.card_nonce, self.card_pubkey, cvc)
+            if session is None and self.key_pool:
+                session = self.key_pool.take()
+
+            session_key, auth_args = calc_xcvc(cmd, self.card_nonce, self.card_pubkey, cvc,
+                                                    session=session)
             args.update(auth_args)
         else:
             session_key = None
@@ -116,6 +156,15 @@ class CKTapCard:
 
         return session_key, self.send(cmd, **args)
 
+    def _get_status(self):
+        # Same as send('status'), but may answer from our copy of the last response
+        # if nothing since then could have changed it. Saves one APDU.
+        if self.cache_status and self._last_status is not None:
+            rv = dict(self._last_status)
+            rv['card_nonce'] = self.card_nonce
+            return rv
+
+        return self.send('status')
 
     #
     # Wrappers and Helpers
@@ -126,7 +175,7 @@ class CKTapCard:
         # - returns a bech32 address as a string, or tuple(compressed_pubkey, bech32),
         assert not self.is_tapsigner
 
-        st = self.send('status')
+        st = self._get_status()
         cur_slot = st['slots'][0]
         last_slot = self.num_slots - 1
         if slot is None:
@@ -210,7 +259,7 @@ class CKTapCard:
         # TAPSIGNER only: what's the current derivation path, which might be
         # just empty (aka 'm').
         assert self.is_tapsigner
-        st = self.send('status')
+        st = self._get_status()
         path = st.get('path', None)
         if path is None:
             raise RuntimeError("No private key picked yet.")
@@ -266,7 +315,7 @@ class CKTapCard:
         # - if subpath is provided, fetch the xpub (derived on-card)
         #   and apply further bip32 (unhardened) derivation off-card (here)
         # - in any case, return None if no keypair defined yet for current slot
-        st = self.send('status')
+        st = self._get_status()
 
         if self.is_tapsigner:
             if 'path' not in st:
@@ -334,7 +383,7 @@ class CKTapCard:
         # - does not relate to payment addresses or slot usage
         # - raises on errors/failed validation
         # - 'pubkey' is expected key of the sealed slot (or None)
-        st = self.send('status')
+        st = self._get_status()
         certs = self.send('certs')
 
         n = pick_nonce()
@@ -419,6 +468,60 @@ class CKTapCard:
 
         return (addr, status, here)
 
+    def _check_sign_subpath(self, sub: List[int]):
+        # Signing subpath can be at most two non-hardened components
+        if sub and not self.is_tapsigner:
+            raise ValueError(f"Cannot use 'subpath/fullpath' option for {self.product_name}")
+
+        if len(sub) > 2:
+            raise ValueError(f"Length of subpath {path2str(sub)[2:]} is greater than 2")
+
+        if not none_hardened(sub):
+            raise ValueError(f"subpath {path2str(sub)[2:]} contains hardened components")
+
+    def _sign_once(self, cvc, digest, slot, sub, session=None):
+        # Send one 'sign' command, returns (sig, pubkey) as provided by card, not
+        # yet verified. Returns None if card picked an unlucky number; just retry.
+        try:
+            if self.is_tapsigner:
+                ses_key, resp = self.send_auth('sign', cvc, session=session,
+                                                slot=0, digest=digest, subpath=sub)
+            else:
+                # Important: do not pass subpath argument to a SATSCARD
+                # where it is not applicable and triggers a bug in early versions.
+                ses_key, resp = self.send_auth('sign', cvc, session=session,
+                                                slot=slot, digest=digest)
+        except CardRuntimeError as err:
+            if err.code == 205:  # unlucky number
+                if self.applet_version == '0.9.0':
+                    # workaround: get status to update card's nonce
+                    self.send('status')
+                return None
+            raise
+
+        return resp['sig'], resp['pubkey']
+
+    def _finish_sig(self, digest, sig, expect_pub):
+        # Verify the card's signature and make it recoverable, or None if it's bad
+        if not CT_sig_verify(expect_pub, digest, sig):
+            return None
+
+        return make_recoverable_sig(digest, sig, addr=None, expect_pubkey=expect_pub,
+                                       is_testnet=self.is_testnet)
+
+    def _sign_retries(self, cvc, digest, slot, sub, session=None):
+        # Sign with retries, for unlucky numbers and bad signatures
+        for _ in range(5):
+            got = self._sign_once(cvc, digest, slot, sub, session=session)
+            if got:
+                rec_sig = self._finish_sig(digest, *got)
+                if rec_sig:
+                    return rec_sig
+
+        # probability that we get here is very close to zero
+        msg = "Failed to sign digest after 5 retries. Try again."
+        raise CardRuntimeError(f'500 on sign: {msg}', 500, msg)
+
     def sign_digest(self, cvc: str, digest: bytes, slot: int=0, subpath: str=None, fullpath: str=None) -> bytes:
         """
         Sign 32 bytes digest and return 65 bytes long recoverable signature.
@@ -444,42 +547,63 @@ class CKTapCard:
         else:
             sub = str2path(subpath) if subpath else []
 
-        if len(sub) > 2:
-            raise ValueError(f"Length of subpath {path2str(sub)[2:]} is greater than 2")
+        self._check_sign_subpath(sub)
 
-        if not none_hardened(sub):
-            raise ValueError(f"subpath {path2str(sub)[2:]} contains hardened components")
+        return self._sign_retries(cvc, digest, slot, sub)
 
-        if self.is_tapsigner:
-            slot = 0
+    def sign_digests(self, cvc: str, items, slot: int=0) -> List[SignResult]:
+        """
+        Sign many 32 bytes digests: items is a list of (digest, subpath) tuples.
 
-        for _ in range(5):
-            try:
-                if self.is_tapsigner:
-                    ses_key, resp = self.send_auth('sign', cvc, slot=slot, digest=digest, subpath=sub)
+        Each item follows the same rules as sign_digest(); subpath can be None.
+        A single ephemeral key (one ECDH) is used for all the 'sign' commands, as the
+        protocol allows, and each signature is checked while the card is already
+        working on the next one.
+
+        Returns SignResult(sig, elapsed) for each item, in same order. Signature is
+        65 bytes recoverable, elapsed is seconds spent on that item.
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        todo = []
+        for digest, subpath in items:
+            if len(digest) != 32:
+                raise ValueError("Digest must be exactly 32 bytes")
+            sub = str2path(subpath) if subpath else []
+            self._check_sign_subpath(sub)
+            todo.append((digest, sub))
+
+        session = self.key_pool.take() if self.key_pool else calc_session_key(self.card_pubkey)
+
+        def check(digest, got, started):
+            return self._finish_sig(digest, *got), time.perf_counter() - started
+
+        checks = []
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='cktap-sigcheck') as checker:
+            for digest, sub in todo:
+                started = time.perf_counter()
+                for _ in range(5):
+                    got = self._sign_once(cvc, digest, slot, sub, session=session)
+                    if got: break
                 else:
-                    # Important: do not pass subpath argument to a SATSCARD
-                    # where it is not applicable and triggers a bug in early versions.
-                    ses_key, resp = self.send_auth('sign', cvc, slot=slot, digest=digest)
-
-                expect_pub = resp['pubkey']
-                sig = resp['sig']
-                if not CT_sig_verify(expect_pub, digest, sig):
-                    continue
-                rec_sig = make_recoverable_sig(digest, sig, addr=None, expect_pubkey=expect_pub,
-                                               is_testnet=self.is_testnet)
-                return rec_sig
-            except CardRuntimeError as err:
-                if err.code == 205:  # unlucky number
-                    if self.applet_version == '0.9.0':
-                        # workaround: get status to update card's nonce
-                        self.send('status')
-                    continue
-                raise
+                    msg = "Failed to sign digest after 5 retries. Try again."
+                    raise CardRuntimeError(f'500 on sign: {msg}', 500, msg)
 
-        # probability that we get here is very close to zero
-        msg = "Failed to sign digest after 5 retries. Try again."
-        raise CardRuntimeError(f'500 on sign: {msg}', 500, msg)
+                checks.append(checker.submit(check, digest, got, started))
+
+            results = [c.result() for c in checks]
+
+        rv = []
+        for (digest, sub), (rec_sig, elapsed) in zip(todo, results):
+            if not rec_sig:
+                # rare: card gave a bad signature, try again the slow way
+                started = time.perf_counter()
+                rec_sig = self._sign_retries(cvc, digest, slot, sub, session=session)
+                elapsed += time.perf_counter() - started
+
+            rv.append(SignResult(rec_sig, elapsed))
+
+        return rv
 
     # TODO
     # - 'wait' command which does delay needed, if any (but has no UX)
@@ -1,8 +1,17 @@
 # Copyright (c) 2021 Pieter Wuille
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
-"""Test-only pure Python RIPEMD160 implementation."""
+"""Pure Python RIPEMD160 implementation.
 
+Only used when neither OpenSSL (via hashlib) nor wally can provide RIPEMD160,
+see cktap.compat. Offers the same interface as hashlib objects:
+
+    h = RIPEMD160(b'abc')
+    h.update(more)
+    h.digest()
+"""
+
+import struct
 import unittest
 
 # Message schedule indexes for the left path.
@@ -41,72 +50,129 @@ RR = [
     8, 5, 12, 9, 12, 5, 14, 6, 8, 13, 6, 5, 15, 13, 11, 11
 ]
 
-# K constants for the left path.
-KL = [0, 0x5a827999, 0x6ed9eba1, 0x8f1bbcdc, 0xa953fd4e]
-
-# K constants for the right path.
-KR = [0x50a28be6, 0x5c4dd124, 0x6d703ef3, 0x7a6d76e9, 0]
-
-
-def fi(x, y, z, i):
-    """The f1, f2, f3, f4, and f5 functions from the specification."""
-    if i == 0:
-        return x ^ y ^ z
-    elif i == 1:
-        return (x & y) | (~x & z)
-    elif i == 2:
-        return (x | ~y) ^ z
-    elif i == 3:
-        return (x & z) | (y & ~z)
-    elif i == 4:
-        return x ^ (y | ~z)
-    else:
-        assert False
-
-
-def rol(x, i):
-    """Rotate the bottom 32 bits of x left by i bits."""
-    return ((x << i) | ((x & 0xffffffff) >> (32 - i))) & 0xffffffff
-
-
-def compress(h0, h1, h2, h3, h4, block):
-    """Compress state (h0, h1, h2, h3, h4) with block."""
-    # Left path variables.
-    al, bl, cl, dl, el = h0, h1, h2, h3, h4
-    # Right path variables.
-    ar, br, cr, dr, er = h0, h1, h2, h3, h4
-    # Message variables.
-    x = [int.from_bytes(block[4*i:4*(i+1)], 'little') for i in range(16)]
-
-    # Iterate over the 80 rounds of the compression.
-    for j in range(80):
-        rnd = j >> 4
-        # Perform left side of the transformation.
-        al = rol(al + fi(bl, cl, dl, rnd) + x[ML[j]] + KL[rnd], RL[j]) + el
-        al, bl, cl, dl, el = el, al, bl, rol(cl, 10), dl
-        # Perform right side of the transformation.
-        ar = rol(ar + fi(br, cr, dr, 4 - rnd) + x[MR[j]] + KR[rnd], RR[j]) + er
-        ar, br, cr, dr, er = er, ar, br, rol(cr, 10), dr
+# Per-round (message word index, rotation) pairs, 5 rounds of 16 steps.
+STEPS_L = [list(zip(ML[16*r:16*(r+1)], RL[16*r:16*(r+1)])) for r in range(5)]
+STEPS_R = [list(zip(MR[16*r:16*(r+1)], RR[16*r:16*(r+1)])) for r in range(5)]
+
+M32 = 0xffffffff
+INITIAL_STATE = (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0)
+
+BLOCK_WORDS = struct.Struct('<16L')
+LENGTH = struct.Struct('<Q')
+
+
+def compress(h0, h1, h2, h3, h4, x):
+    """Compress state (h0, h1, h2, h3, h4) with block x, as 16 little-endian words.
+
+    Round functions (f1..f5 of the specification) and rotations are written
+    out for each round, so each step is plain integer arithmetic.
+    """
+    # Left path.
+    a, b, c, d, e = h0, h1, h2, h3, h4
+    for i, s in STEPS_L[0]:
+        t = (a + (b ^ c ^ d) + x[i]) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in STEPS_L[1]:
+        t = (a + ((b & c) | (~b & d)) + x[i] + 0x5a827999) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in STEPS_L[2]:
+        t = (a + ((b | ~c) ^ d) + x[i] + 0x6ed9eba1) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in STEPS_L[3]:
+        t = (a + ((b & d) | (c & ~d)) + x[i] + 0x8f1bbcdc) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in STEPS_L[4]:
+        t = (a + (b ^ (c | ~d)) + x[i] + 0xa953fd4e) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    al, bl, cl, dl, el = a, b, c, d, e
+
+    # Right path: same round functions, in reverse order.
+    a, b, c, d, e = h0, h1, h2, h3, h4
+    for i, s in STEPS_R[0]:
+        t = (a + (b ^ (c | ~d)) + x[i] + 0x50a28be6) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in STEPS_R[1]:
+        t = (a + ((b & d) | (c & ~d)) + x[i] + 0x5c4dd124) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in STEPS_R[2]:
+        t = (a + ((b | ~c) ^ d) + x[i] + 0x6d703ef3) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in STEPS_R[3]:
+        t = (a + ((b & c) | (~b & d)) + x[i] + 0x7a6d76e9) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
+    for i, s in STEPS_R[4]:
+        t = (a + (b ^ c ^ d) + x[i]) & M32
+        a, b, c, d, e = e, (((t << s) | (t >> (32 - s))) + e) & M32, b, ((c << 10) | (c >> 22)) & M32, d
 
     # Compose old state, left transform, and right transform into new state.
-    return h1 + cl + dr, h2 + dl + er, h3 + el + ar, h4 + al + br, h0 + bl + cr
+    return ((h1 + cl + d) & M32, (h2 + dl + e) & M32, (h3 + el + a) & M32,
+            (h4 + al + b) & M32, (h0 + bl + c) & M32)
+
+
+class RIPEMD160:
+    """Incremental RIPEMD-160, with the same methods as hashlib objects."""
+
+    name = 'ripemd160'
+    digest_size = 20
+    block_size = 64
+
+    __slots__ = ('_state', '_buf', '_count')
+
+    def __init__(self, data=b''):
+        self._state = INITIAL_STATE
+        self._buf = b''         # partial block, less than 64 bytes
+        self._count = 0         # total bytes hashed
+        if data:
+            self.update(data)
+
+    def update(self, data):
+        """Hash more data: any bytes-like object, without copying full blocks."""
+        mv = memoryview(data)
+        if mv.ndim != 1 or mv.itemsize != 1:
+            mv = mv.cast('B')
+        self._count += len(mv)
+
+        state = self._state
+        pos = 0
+        if self._buf:
+            # complete the partial block first
+            pos = 64 - len(self._buf)
+            self._buf += bytes(mv[:pos])
+            if len(self._buf) < 64:
+                return
+            state = compress(*state, BLOCK_WORDS.unpack(self._buf))
+
+        unpack_from = BLOCK_WORDS.unpack_from
+        end = len(mv) - 63
+        while pos < end:
+            state = compress(*state, unpack_from(mv, pos))
+            pos += 64
+
+        self._buf = bytes(mv[pos:])
+        self._state = state
+
+    def copy(self):
+        """Return a clone, so common prefixes need only be hashed once."""
+        rv = RIPEMD160.__new__(RIPEMD160)
+        rv._state, rv._buf, rv._count = self._state, self._buf, self._count
+        return rv
+
+    def digest(self):
+        """Hash of all data so far; object can still be updated afterwards."""
+        fin = self._buf + b"\x80" + b"\x00" * ((119 - self._count) & 63) \
+                + LENGTH.pack((8 * self._count) & 0xffffffffffffffff)
+        state = self._state
+        for pos in range(0, len(fin), 64):
+            state = compress(*state, BLOCK_WORDS.unpack_from(fin, pos))
+        return struct.pack('<5L', *state)
+
+    def hexdigest(self):
+        return self.digest().hex()
 
 
 def ripemd160(data):
     """Compute the RIPEMD-160 hash of data."""
-    # Initialize state.
-    state = (0x67452301, 0xefcdab89, 0x98badcfe, 0x10325476, 0xc3d2e1f0)
-    # Process full 64-byte blocks in the input.
-    for b in range(len(data) >> 6):
-        state = compress(*state, data[64*b:64*(b+1)])
-    # Construct final blocks (with padding and size).
-    pad = b"\x80" + b"\x00" * ((119 - len(data)) & 63)
-    fin = data[len(data) & ~63:] + pad + (8 * len(data)).to_bytes(8, 'little')
-    # Process final blocks.
-    for b in range(len(fin) >> 6):
-        state = compress(*state, fin[64*b:64*(b+1)])
-    # Produce output.
-    return b"".join((h & 0xffffffff).to_bytes(4, 'little') for h in state)
+    return RIPEMD160(data).digest()
 
 
 class TestFrameworkKey(unittest.TestCase):
@@ -128,3 +194,21 @@ class TestFrameworkKey(unittest.TestCase):
             (b"a" * 1000000, "52783243c1697bdbe16d37f97f68f08325dc1528")
         ]:
             self.assertEqual(ripemd160(msg).hex(), hexout)
+
+    def test_streaming(self):
+        """Same result, regardless of how input is split up."""
+        msg = bytes(range(256)) * 5
+        expect = ripemd160(msg)
+        for step in [1, 3, 63, 64, 65, 200]:
+            h = RIPEMD160()
+            for pos in range(0, len(msg), step):
+                h.update(msg[pos:pos+step])
+            self.assertEqual(h.digest(), expect)
+
+        h = RIPEMD160(msg[:100])
+        h2 = h.copy()
+        h.update(msg[100:])
+        self.assertEqual(h.digest(), expect)
+        self.assertEqual(h2.digest(), ripemd160(msg[:100]))
+        self.assertEqual(h.hexdigest(), expect.hex())
+        self.assertEqual(RIPEMD160(bytearray(msg)).digest(), expect)
@@ -6,8 +6,11 @@
 # - Requires 'requests[socks]' module
 # - Will try to use Tor if you have it running locally already
 # - Uses data from <blockstream.info> by default
+# - Can keep responses in a cache directory (set CKTAP_CACHE_DIR), but that is off
+#   by default: it records on disk which addresses you looked at, and their UTXO
 #
-import sys, os, time, json
+import sys, os, re, time, json, socket, hashlib, tempfile, threading
+from concurrent.futures import ThreadPoolExecutor
 from pprint import pformat
 from getpass import getpass
 from collections import namedtuple
@@ -20,15 +23,114 @@ ONION_SERVER = 'http://explorerzydxu5ecjrkwceayqybizmpjjznk5izmitf2modhcusuqlid.
 # we check for any of these ports being open and assume it's Tor if found
 LOCALHOST_PROXY_PORTS = [ 9150, 9050 ]
 
+# how long to remember result of looking for Tor (seconds), and probe timeout
+TOR_CACHE_TTL = 300
+TOR_PROBE_TIMEOUT = 0.5
+
+# (port or None, expiry time) from last check; see find_tor_port()
+_tor_cache = None
+_tor_override = None
+_tor_lock = threading.Lock()
+
+# server returns confirmed history this many txns at a time
+TXS_PAGE_SIZE = 25
+
+# max requests in flight at once, per server; also the HTTP connection pool size
+MAX_WORKERS = 8
+
+# on-disk cache of server responses, only used if set (ie. CKTAP_CACHE_DIR=~/.cache/cktap)
+# - plain JSON files, never pruned: use ResponseCache.clear() or just delete them
+CACHE_DIR = os.path.expanduser(os.environ.get('CKTAP_CACHE_DIR', '')) or None
+
+# confirmed transactions are kept forever, but UTXO sets only this long (seconds)
+UTXO_CACHE_TTL = 60
+
+TX_PATH = re.compile(r'^(/testnet)?/api/tx/[0-9a-f]{64}$')
+UTXO_PATH = re.compile(r'^(/testnet)?/api/address/[^/]+/utxo$')
+
+# shared connections, by server; see get_connection()
+_connections = {}
+_connections_lock = threading.Lock()
+
+class ResponseCache:
+    # Directory of JSON files, named by hash of the URL they came from.
+    # - each holds the response and when it expires (None for never)
+    # - files are written atomically, so concurrent users are safe
+    # - any problem reading an entry is just a cache miss
+
+    def __init__(self, path):
+        self.path = path
+
+    def filename(self, url):
+        h = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.path, h[0:2], h + '.json')
+
+    def get(self, url):
+        # return cached response, or None
+        try:
+            with open(self.filename(url), 'rt') as fd:
+                rec = json.load(fd)
+            if rec['url'] != url:
+                return None
+            if rec['expires'] is not None and rec['expires'] <= time.time():
+                return None
+            return rec['data']
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def put(self, url, data, ttl=None):
+        # save response, for ttl seconds or forever
+        fn = self.filename(url)
+        expires = None if ttl is None else time.time() + ttl
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(fn), suffix='.tmp')
+            with os.fdopen(fd, 'wt') as f:
+                json.dump(dict(url=url, expires=expires, data=data), f)
+            os.replace(tmp, fn)
+        except OSError:
+            # read-only or full disk: carry on without caching
+            if tmp:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+
+    def clear(self):
+        import shutil
+        shutil.rmtree(self.path, ignore_errors=True)
+
+def cache_lifetime(path, data):
+    # How long a response may be cached: None for forever, 0 for not at all
+    if TX_PATH.match(path):
+        # will never change, once in a block (barring reorg)
+        confirmed = isinstance(data, dict) and data.get('status', {}).get('confirmed')
+        return None if confirmed else 0
+    if UTXO_PATH.match(path):
+        return UTXO_CACHE_TTL
+    return 0
+
 class NetConnection:
 
-    def __init__(self, server=None):
+    def __init__(self, server=None, cache_dir=None):
+        # - cache_dir: where to keep responses, default is CACHE_DIR (if any); False for no cache
         import requests
         self.ses = requests.Session()
+
+        # allow that many concurrent requests to reuse their connections
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=MAX_WORKERS)
+        self.ses.mount('https://', adapter)
+        self.ses.mount('http://', adapter)
+
         self.is_tor = self.tor_upgrade()
         self.server = server or (DEFAULT_SERVER if not self.is_tor else ONION_SERVER)
         assert not self.server.endswith('/')
 
+        if cache_dir is None:
+            cache_dir = CACHE_DIR
+        self.cache = ResponseCache(cache_dir) if cache_dir else None
+
         # I want no user-agent header at all, so have to
         # use this one strange hack on urllib3...
         try:
@@ -43,8 +145,6 @@ class NetConnection:
         # - you can override with HTTP_PROXY / HTTPS_PROXY in environment
         #   which would be directly implemented in requests, see
         #   <https://2.python-requests.org/en/master/user/advanced/#proxies>
-        import requests
-
         if ('HTTP_PROXY' in os.environ) or ('HTTPS_PROXY' in os.environ) or self.ses.proxies:
             return False
 
@@ -54,52 +154,147 @@ class NetConnection:
         except ImportError:
             return False
 
-        for port in LOCALHOST_PROXY_PORTS:
-            try:
-                r = requests.get(f'http://127.0.0.1:{port}')
-            except:
-                continue
-            if ('This is a SOCKS Proxy, Not An HTTP Proxy' in r.text):
-                # usual socks error message from Tord running locally.
-                self.ses.proxies['https'] = f'socks5h://127.0.0.1:{port}'
-                self.ses.proxies['http'] = f'socks5h://127.0.0.1:{port}'
+        port = find_tor_port()
+        if not port:
+            return False
 
-                return True
+        self.ses.proxies['https'] = f'socks5h://127.0.0.1:{port}'
+        self.ses.proxies['http'] = f'socks5h://127.0.0.1:{port}'
+
+        return True
 
-        return False
-            
     def get_json(self, path, **kws):
-        # fetch a JSON response
+        # fetch a JSON response, or use a cached copy if we can
         assert path[0] == '/'
-        r = self.ses.get(self.server + path, **kws)
+        url = self.server + path
+        cachable = self.cache and not kws and (TX_PATH.match(path) or UTXO_PATH.match(path))
+
+        if cachable:
+            rv = self.cache.get(url)
+            if rv is not None:
+                return rv
+
+        r = self.ses.get(url, **kws)
         r.raise_for_status()
         try:
-            return r.json()
+            rv = r.json()
         except json.decoder.JSONDecodeError:
             raise ValueError("Bad json: " + r.text)
-            
 
+        if cachable:
+            ttl = cache_lifetime(path, rv)
+            if ttl != 0:
+                self.cache.put(url, rv, ttl)
+
+        return rv
+
+    def get_json_many(self, paths, **kws):
+        # fetch many JSON responses concurrently, results in same order as paths
+        return run_concurrently([(lambda p=p: self.get_json(p, **kws)) for p in paths])
+
+def probe_socks5(port, timeout=TOR_PROBE_TIMEOUT):
+    # Is there a SOCKS5 proxy (ie. Tor) listening on localhost at that port?
+    # - sends the greeting offering "no auth" and checks for acceptance
+    try:
+        with socket.create_connection(('127.0.0.1', port), timeout=timeout) as sock:
+            sock.sendall(b'\x05\x01\x00')
+            return sock.recv(2) == b'\x05\x00'
+    except OSError:
+        return False
+
+def find_tor_port(refresh=False):
+    # Return port number of local Tor SOCKS proxy, or None if not running.
+    # - result is shared by all connections, and re-checked after TOR_CACHE_TTL
+    # - if that finds Tor has started or stopped, shared connections are replaced
+    # - see set_tor_port() to skip the check
+    global _tor_cache
+
+    if _tor_override is not None:
+        return _tor_override or None
+
+    with _tor_lock:
+        now = time.monotonic()
+        if refresh or not _tor_cache or _tor_cache[1] <= now:
+            port = None
+            for p in LOCALHOST_PROXY_PORTS:
+                if probe_socks5(p):
+                    port = p
+                    break
+            if _tor_cache and _tor_cache[0] != port:
+                _forget_connections()
+            _tor_cache = (port, now + TOR_CACHE_TTL)
+
+        return _tor_cache[0]
+
+def set_tor_port(port):
+    # Override Tor detection: port number to use, False to never use Tor,
+    # or None to go back to probing the usual ports.
+    global _tor_override, _tor_cache
+
+    with _tor_lock:
+        _tor_override = port
+        _tor_cache = None
+        _forget_connections()
+
+def _forget_connections():
+    # Tor setting changed: make new shared connections from now on
+    with _connections_lock:
+        _connections.clear()
+
+def get_connection(server=None):
+    # Shared NetConnection for the server: one HTTP session (and one Tor probe)
+    # for the whole process, rather than per-address.
+    # - replaced when Tor comes or goes, see find_tor_port()
+    find_tor_port()
+
+    with _connections_lock:
+        web = _connections.get(server)
+        if web is None:
+            web = _connections[server] = NetConnection(server)
+        return web
+
+def run_concurrently(calls):
+    # call each function, at most MAX_WORKERS at once, return results in order
+    # - first exception raised by any call is re-raised here
+    calls = list(calls)
+    if len(calls) <= 1:
+        return [fn() for fn in calls]
+
+    with ThreadPoolExecutor(max_workers=min(MAX_WORKERS, len(calls))) as pool:
+        return list(pool.map(lambda fn: fn(), calls))
 
-    
 UTXO = namedtuple('UTXO', 'txid vout value height confirmed')
 
 class UTXOList:
 
-    def __init__(self, address, slot_num=None, server=None):
+    def __init__(self, address, slot_num=None, server=None, web=None):
         # must call self.fetch() after setup
+        # - web: NetConnection to use, default is shared one for server
         self.slot = slot_num
         self.addr = address
         self.testnet = address.startswith('tb1')
-        self.web = NetConnection(server)
+        self.web = web or get_connection(server)
         self.utxos = []
 
+        # progress through history, see fetch_history()
+        self.last_seen_txid = None
+        self._spent = set()
 
     def fetch(self):
         # load up the data from network
-        # - TODO: cursor support for > 25 utxo? Not clear if supported on server
+        # - asks for the UTXO set directly, but server may refuse if address
+        #   has a lot of history; then rebuild it from the full history
+        import requests
 
         path = ('/testnet' if self.testnet else '') + f'/api/address/{self.addr}/utxo'
-        ans = self.web.get_json(path)
+        try:
+            ans = self.web.get_json(path)
+        except requests.HTTPError as exc:
+            if exc.response is None or exc.response.status_code != 400:
+                raise
+            return self.fetch_history()
+
+        self.utxos = []
         for u in ans:
             h = u['status'].get('block_height', -1)
             conf = u['status'].get('confirmed', False)
@@ -110,6 +305,67 @@ class UTXOList:
 
         return len(self.utxos)
 
+    def iter_history_pages(self, last_seen_txid=None):
+        # Yield lists of transactions involving this address, newest first.
+        # - mempool first, then confirmed, a page at a time
+        # - or just the confirmed ones older than last_seen_txid
+        # - self.last_seen_txid is updated after each page is consumed
+        prefix = ('/testnet' if self.testnet else '') + f'/api/address/{self.addr}/txs'
+
+        if last_seen_txid is None:
+            page = self.web.get_json(prefix + '/mempool')
+            if page:
+                yield page
+
+        while 1:
+            path = prefix + '/chain' + (f'/{last_seen_txid}' if last_seen_txid else '')
+            page = self.web.get_json(path)
+            if page:
+                yield page
+                last_seen_txid = self.last_seen_txid = page[-1]['txid']
+            if len(page) < TXS_PAGE_SIZE:
+                return
+
+    def iter_history(self, last_seen_txid=None):
+        # Yield each transaction involving this address, newest first; see above.
+        for page in self.iter_history_pages(last_seen_txid):
+            yield from page
+
+    def fetch_history(self, resume=False):
+        # Build UTXO set by reading all transactions for the address.
+        # - only holds one page of history in memory at a time
+        # - with resume, carry on from self.last_seen_txid, after an error
+        #   part way through for example
+        if not (resume and self.last_seen_txid):
+            self.utxos = []
+            self.last_seen_txid = None
+            self._spent = set()
+
+        # Going backwards in time, outputs are spent before we see them created
+        # - but in mempool, or within a block, order isn't known: take whole page
+        for page in self.iter_history_pages(self.last_seen_txid):
+            for tx in page:
+                for i in tx['vin']:
+                    prev = i.get('prevout') or {}
+                    if prev.get('scriptpubkey_address') == self.addr:
+                        self._spent.add((i['txid'], i['vout']))
+
+            for tx in page:
+                h = tx['status'].get('block_height', -1)
+                conf = tx['status'].get('confirmed', False)
+
+                for n, o in enumerate(tx['vout']):
+                    if o.get('scriptpubkey_address') != self.addr:
+                        continue
+                    if (tx['txid'], n) in self._spent:
+                        # each can only be spent once, so done with it
+                        self._spent.discard((tx['txid'], n))
+                        continue
+
+                    self.utxos.append(UTXO(tx['txid'], n, o['value'], h, conf))
+
+        return len(self.utxos)
+
     # never, ever, add these values together!
     def confirmed_balance(self):
         return sum(u.value for u in self.utxos if u.confirmed)
@@ -129,10 +385,15 @@ class UTXOList:
         # - oh, and hashing correctly
         prefix = '/testnet' if self.testnet else ''
 
-        txns = {}
-        for txid in set(u.txid for u in self.utxos):
-            txns[txid] = self.web.get_json(prefix + f'/api/tx/{txid}')
+        txids = sorted(set(u.txid for u in self.utxos))
+        ans = self.web.get_json_many([prefix + f'/api/tx/{txid}' for txid in txids])
+
+        return dict(zip(txids, ans))
 
-        return txns
+def fetch_all(utxo_lists):
+    # Call fetch() on each UTXOList, concurrently; returns the same lists
+    utxo_lists = list(utxo_lists)
+    run_concurrently([ul.fetch for ul in utxo_lists])
+    return utxo_lists
 
 # EOF
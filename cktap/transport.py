@@ -19,14 +19,44 @@ from .proto import CKTapCard
 # Change this to see traffic details
 VERBOSE = False
 
-def find_cards():
+def _probe_reader(r):
+    # Connect to a single reader and return a card object if one of ours is present.
+    # - returns None for empty readers or other cards lying around
+    from smartcard.Exceptions import CardConnectionException, NoCardException
+
+    try:
+        conn = r.createConnection()
+    except:
+        return None
+
+    try:
+        conn.connect()
+        atr = conn.getATR()
+    except (CardConnectionException, NoCardException):
+        #print(f"Empty reader: {r}")
+        return None
+
+    if atr == CARD_ATR:
+        tr = CKTapNFCTransport(conn)
+        return CKTapCard(tr)
+    elif VERBOSE:
+        # could legit be any other NFC card lying around
+        print(f"Got unexpected ATR: {atr}")
+
+    return None
+
+def find_cards(parallel=False, timeout=None, max_workers=None):
     #
     # Search all connected card readers, and find all cards that are present.
     #
     # - generator function.
+    # - with parallel=True, every reader is probed from its own thread and cards are
+    #   yielded as soon as they are ready, so a full scan costs about one reader's latency
+    # - timeout (seconds) is a deadline for the whole parallel scan, counted from its
+    #   start: readers which have not answered by then are skipped. Time the caller
+    #   spends between cards does not count against it.
     #
     from smartcard.System import readers as get_readers
-    from smartcard.Exceptions import CardConnectionException, NoCardException
 
     # emulation running on a Unix socket
     sim = CKTapUnixTransport.find_simulator()
@@ -37,34 +67,256 @@ def find_cards():
     if not readers:
         raise RuntimeError("No USB card readers found. Need at least one.")
 
-    # search for our card
-    for r in readers:
-        try:
-            conn = r.createConnection()
-        except:
-            continue
-        
-        try:
-            conn.connect()
-            atr = conn.getATR()
-        except (CardConnectionException, NoCardException):
-            #print(f"Empty reader: {r}")
-            continue
+    if not parallel or len(readers) == 1:
+        # search for our card, one reader at a time
+        for r in readers:
+            card = _probe_reader(r)
+            if card:
+                yield card
+        return
+
+    import time
+    from concurrent.futures import ThreadPoolExecutor
 
-        if atr == CARD_ATR:
-            tr = CKTapNFCTransport(conn)
-            yield CKTapCard(tr)
-        elif VERBOSE:
-            # could legit be any other NFC card lying around
-            print(f"Got unexpected ATR: {atr}")
+    deadline = None if timeout is None else time.monotonic() + timeout
 
-def find_first():
+    pool = ThreadPoolExecutor(max_workers=(max_workers or len(readers)),
+                                thread_name_prefix='cktap-reader')
+    try:
+        yield from claim_probes([pool.submit(_timed_probe, r) for r in readers], deadline)
+    finally:
+        pool.shutdown(wait=False)
+
+def claim_probes(futures, deadline=None, release=None):
+    #
+    # Yield cards from reader probes running in the background, fastest first.
+    #
+    # - futures are concurrent.futures.Future giving (card or None, time.monotonic()
+    #   when done), see _timed_probe()
+    # - deadline is a time.monotonic() value: cards found after it are skipped, but
+    #   those found before it are always yielded, however slow the caller is
+    # - every card we don't yield (too late, or caller stopped early) is passed to
+    #   release(fut) once its probe is done; default just closes the card.
+    #   Also called for probes which never ran, since we cancel those.
+    #
+    import time
+    from concurrent.futures import wait, FIRST_COMPLETED
+
+    release = release or _close_unclaimed
+    pending = set(futures)
+
+    try:
+        while pending:
+            left = None if deadline is None else max(0, deadline - time.monotonic())
+            done, _ = wait(pending, timeout=left, return_when=FIRST_COMPLETED)
+            if not done:
+                if VERBOSE:
+                    print(f"Gave up on {len(pending)} slow reader(s)")
+                break
+
+            for fut in sorted(done, key=_finish_time):
+                pending.discard(fut)
+                try:
+                    card, finished = fut.result()
+                except Exception as exc:
+                    # one misbehaving reader should not spoil the whole scan
+                    if VERBOSE:
+                        print(f"Reader probe failed: {exc}")
+                    release(fut)
+                    continue
+
+                if (deadline is not None and finished > deadline) or not card:
+                    # answered too late; we only noticed because caller was busy
+                    release(fut)
+                    continue
+
+                yield card
+
+    finally:
+        # caller may stop early (ie. find_first) or we timed-out: release any
+        # cards that are still being found, whenever they complete
+        for fut in pending:
+            fut.cancel()
+            fut.add_done_callback(release)
+
+def _timed_probe(r):
+    # _probe_reader() in a worker thread, also noting when it finished
+    import time
+    card = _probe_reader(r)
+    return card, time.monotonic()
+
+def _finish_time(fut):
+    # sort key for completed probes, failures first
+    try:
+        return fut.result()[1]
+    except Exception:
+        return 0
+
+def _close_unclaimed(fut):
+    # Release a card found by a background probe that no-one is waiting for anymore.
+    if fut.cancelled() or fut.exception():
+        return
+    card, _ = fut.result()
+    if card:
+        try:
+            card.close()
+        except Exception:
+            pass
+
+def find_first(**kws):
     # operate on the first card we can find
-    for c in find_cards():
+    # - accepts same arguments as find_cards()
+    for c in find_cards(**kws):
         return c
 
     return None
 
+class CardMonitor:
+    #
+    # Event-driven alternative to calling find_cards() over and over.
+    #
+    # - built on pyscard's card-insertion observer, so the PC/SC stack tells us
+    #   when a card arrives or leaves, and we never busy-loop on the readers
+    # - keeps the connection open while our card stays on the reader
+    # - on_insert(card) and on_remove(card) are called from pyscard's monitor
+    #   thread; or use wait_for_card() from your own thread instead
+    # - removed cards are closed, so further use of them will fail
+    #
+    def __init__(self, on_insert=None, on_remove=None):
+        import threading, queue
+
+        self.on_insert = on_insert
+        self.on_remove = on_remove
+
+        # reader name => CKTapCard currently on that reader
+        self.cards = {}
+
+        self._lock = threading.Lock()
+        self._arrivals = queue.Queue()
+        self._monitor = None
+        self._observer = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        # Begin watching all readers. Cards already in place are reported as inserted.
+        from smartcard.CardMonitoring import CardMonitor as PCSCMonitor, CardObserver
+
+        if self._monitor:
+            return
+
+        # emulation has no insert/remove events, just report it if running
+        sim = CKTapUnixTransport.find_simulator()
+        if sim:
+            self._inserted(sim.name, CKTapCard(sim))
+
+        owner = self
+
+        class _Observer(CardObserver):
+            def update(self, observable, actions):
+                # runs in pyscard's monitor thread: must not raise, or events stop
+                added, removed = actions
+                for c in removed:
+                    try:
+                        owner._removed(str(c.reader))
+                    except Exception as exc:
+                        if VERBOSE:
+                            print(f"Card removal on {c.reader} failed: {exc}")
+                for c in added:
+                    try:
+                        owner._probe(c)
+                    except Exception as exc:
+                        if VERBOSE:
+                            print(f"Card insertion on {c.reader} failed: {exc}")
+
+        self._observer = _Observer()
+        self._monitor = PCSCMonitor()
+        self._monitor.addObserver(self._observer)
+
+    def stop(self):
+        # Stop watching and release all cards we are holding.
+        if self._monitor:
+            self._monitor.deleteObserver(self._observer)
+            self._monitor = self._observer = None
+
+        for reader in list(self.cards):
+            self._removed(reader)
+
+    def wait_for_card(self, timeout=None):
+        # Block until a card is inserted (or already waiting), returns None on timeout.
+        # - skips cards that were removed again before anyone asked for them
+        import queue, time
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while 1:
+            left = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                card = self._arrivals.get(timeout=left)
+            except queue.Empty:
+                return None
+
+            with self._lock:
+                if any(c is card for c in self.cards.values()):
+                    return card
+
+    def _probe(self, pcsc_card):
+        # pyscard found a card; is it one of ours?
+        from smartcard.Exceptions import CardConnectionException, NoCardException
+
+        if pcsc_card.atr != CARD_ATR:
+            if VERBOSE:
+                print(f"Got unexpected ATR: {pcsc_card.atr}")
+            return
+
+        conn = None
+        try:
+            conn = pcsc_card.createConnection()
+            conn.connect()
+            card = CKTapCard(CKTapNFCTransport(conn))
+        except (CardConnectionException, NoCardException):
+            # tapped and gone again already
+            return
+        except Exception as exc:
+            # pulled away mid-exchange (bad CBOR), or card not happy: skip it
+            if VERBOSE:
+                print(f"Card on {pcsc_card.reader} not usable: {exc}")
+            try:
+                conn.disconnect()
+            except Exception:
+                pass
+            return
+
+        self._inserted(str(pcsc_card.reader), card)
+
+    def _inserted(self, reader, card):
+        with self._lock:
+            self.cards[reader] = card
+
+        self._arrivals.put(card)
+        if self.on_insert:
+            self.on_insert(card)
+
+    def _removed(self, reader):
+        with self._lock:
+            card = self.cards.pop(reader, None)
+
+        if not card:
+            return
+
+        try:
+            card.close()
+        except Exception:
+            # card has already left the field, so disconnect may complain
+            pass
+
+        if self.on_remove:
+            self.on_remove(card)
+
 class CKTapTransportABC:
     #
     # Abstract base class. Low level details about talking our protocol.
@@ -10,7 +10,7 @@ from cktap.compat import CT_ecdh, CT_sig_verify, CT_sig_to_pubkey, CT_pick_keypa
 from cktap.compat import CT_bip32_derive, CT_priv_to_pubkey
 from cktap.descriptors import descsum_create
 from cktap.base58 import encode_base58_checksum
-from cktap.bech32 import encode as bech32_encode
+from cktap.bech32 import encode_p2wpkh
 
 # show bytes as hex in a string
 B2A = lambda x: b2a_hex(x).decode('ascii')
@@ -225,20 +225,29 @@ def force_bytes(foo):
     # convert strings to bytes where needed
     return foo.encode('ascii') if isinstance(foo, str) else foo
 
-def calc_xcvc(cmd, card_nonce, his_pubkey, cvc):
+def calc_session_key(his_pubkey):
+    # Pick a fresh ephemeral keypair for our side and do ECDH with the card's pubkey
+    # - returns (session_key, my_pubkey), which is what calc_xcvc() needs
+    # - protocol allows reuse of this pair for repeats of the *same* command
+    my_privkey, my_pubkey = CT_pick_keypair()
+
+    # standard ECDH
+    # - result is sha256s(compressed shared point (33 bytes))
+    session_key = CT_ecdh(his_pubkey, my_privkey)
+
+    return session_key, my_pubkey
+
+def calc_xcvc(cmd, card_nonce, his_pubkey, cvc, session=None):
     # Calcuate session key and xcvc value need for auth'ed commands
     # - also picks an arbitrary keypair for my side of the ECDH?
     # - requires pubkey from card and proposed CVC value
+    # - or provide session=(session_key, my_pubkey) from calc_session_key()
     assert 6 <= len(cvc) <= 32
 
     cvc = force_bytes(cvc)
 
-    # fresh new ephemeral key for our side of connection
-    my_privkey, my_pubkey = CT_pick_keypair()
-
-    # standard ECDH
-    # - result is sha256s(compressed shared point (33 bytes))
-    session_key = CT_ecdh(his_pubkey, my_privkey)
+    # fresh new ephemeral key for our side of connection, unless provided
+    session_key, my_pubkey = session or calc_session_key(his_pubkey)
 
     md = sha256s(card_nonce + cmd.encode('ascii'))
     mask = xor_bytes(session_key, md)[0:len(cvc)]
@@ -246,6 +255,54 @@ def calc_xcvc(cmd, card_nonce, his_pubkey, cvc):
 
     return session_key, dict(epubkey=my_pubkey, xcvc=xcvc)
 
+class SessionKeyPool:
+    #
+    # Pre-computes ephemeral keypairs and their ECDH session keys for one card,
+    # using a background thread. Authenticated commands then only need the cheap
+    # SHA256 + XOR steps of calc_xcvc() at send time. Helps on slow hosts.
+    #
+    # - each entry is handed out once, never shared between commands
+    # - if the pool runs dry, we compute on the spot (same as without pool)
+    #
+    def __init__(self, his_pubkey, size=4):
+        import threading, queue
+
+        assert len(his_pubkey) == 33
+        self.his_pubkey = his_pubkey
+        self._ready = queue.Queue(maxsize=size)
+        self._stop = threading.Event()
+
+        self._thread = threading.Thread(target=self._fill, name='cktap-keypool', daemon=True)
+        self._thread.start()
+
+    def _fill(self):
+        import queue
+
+        while not self._stop.is_set():
+            item = calc_session_key(self.his_pubkey)
+
+            while not self._stop.is_set():
+                try:
+                    self._ready.put(item, timeout=0.25)
+                    break
+                except queue.Full:
+                    continue
+
+    def take(self):
+        # get (session_key, my_pubkey) to use with calc_xcvc()
+        import queue
+        try:
+            return self._ready.get_nowait()
+        except queue.Empty:
+            return calc_session_key(self.his_pubkey)
+
+    def close(self):
+        # stop background work, and forget any keys we made
+        self._stop.set()
+        self._thread.join()
+        while not self._ready.empty():
+            self._ready.get_nowait()
+
 def render_address(pubkey, testnet=False):
     # make the text string used as a payment address
 
@@ -254,7 +311,7 @@ def render_address(pubkey, testnet=False):
         pubkey = CT_priv_to_pubkey(pubkey)
 
     HRP = 'bc' if not testnet else 'tb'
-    return bech32_encode(HRP, 0, hash160(pubkey))
+    return encode_p2wpkh(hash160(pubkey), HRP)
 
 def render_wif(privkey, bip_178=False, electrum=False, testnet=False):
     # Show the WIF in useful text format (base58)
@@ -2,9 +2,10 @@
 # (c) Copyright 2022 by Coinkite Inc. This file is covered by license found in COPYING-CC.
 #
 import os
-from cktap.compat import sha256s
-from cktap.compat import CT_sig_to_pubkey
-from cktap.utils import card_pubkey_to_ident, render_address
+from cktap.compat import sha256s, hash160
+from cktap.compat import CT_sig_to_pubkey, CT_sig_verify
+from cktap.utils import card_pubkey_to_ident
+from cktap.bech32 import encode_p2wpkh
 
 
 def all_keys(sig, md):
@@ -17,9 +18,60 @@ def all_keys(sig, md):
             if rec_id >= 2: continue        # because crypto I don't understand
             raise
 
-def url_decoder(fragment):
+class IdentityCache:
+    #
+    # Remembers pubkeys of cards we have verified before, so a repeat tap
+    # needs only one signature check instead of a search over all
+    # recoverable pubkeys. Optional, see url_decoder(cache=...)
+    #
+    # - keyed by card ident prefix (TAPSIGNER) or truncated address (SATSCARD)
+    # - least-recently-used entries dropped beyond max_size
+    # - entries older than ttl seconds are ignored (None = keep forever)
+    # - safe to share between threads
+    #
+    def __init__(self, max_size=10000, ttl=None):
+        import threading
+        from collections import OrderedDict
+
+        self.max_size = max_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        import time
+        with self._lock:
+            here = self._entries.get(key)
+            if here is None:
+                return None
+
+            when, value = here
+            if self.ttl is not None and (time.monotonic() - when) > self.ttl:
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        import time
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+def url_decoder(fragment, cache=None):
     # Takes the URL (after the # part) and verifies it
     # and returns dict of useful values, or raise on errors/frauds
+    # - cache: optional IdentityCache, speeds up cards seen before
     from urllib.parse import parse_qsl
 
     assert '#' not in fragment
@@ -50,14 +102,24 @@ def url_decoder(fragment):
         card_ident = bytes.fromhex(card_ident)
         full_card_ident = None
 
-        for pubkey in all_keys(sig, md):
-            expect = sha256s(pubkey)
-            if expect[0:8] == card_ident:
-                full_card_ident = card_pubkey_to_ident(pubkey)
-                break
+        known = cache.get(('t', card_ident)) if cache is not None else None
+        if known:
+            pubkey, ident = known
+            if CT_sig_verify(pubkey, md, sig):
+                full_card_ident = ident
 
         if not full_card_ident:
-            raise RuntimeError("Could not reconstruct card ident.")
+            for pubkey in all_keys(sig, md):
+                expect = sha256s(pubkey)
+                if expect[0:8] == card_ident:
+                    full_card_ident = card_pubkey_to_ident(pubkey)
+                    break
+
+            if not full_card_ident:
+                raise RuntimeError("Could not reconstruct card ident.")
+
+            if cache is not None:
+                cache.put(('t', card_ident), (pubkey, full_card_ident))
 
         return dict(nonce=nonce.hex(),
                     card_ident=full_card_ident,
@@ -70,14 +132,26 @@ def url_decoder(fragment):
         is_testnet = False
         state = dict(S='Sealed', U='UNSEALED', E='Error/Tampered').get(raw['u'], 'Unknown state')
 
-        for pubkey in all_keys(sig, md):
+        known = cache.get(('s', addr)) if (cache is not None and addr) else None
+        if known:
+            pubkey, got, testnet = known
+            if CT_sig_verify(pubkey, md, sig):
+                confirmed_addr = got
+                is_testnet = testnet
+            else:
+                known = None
+
+        for pubkey in ([] if confirmed_addr else all_keys(sig, md)):
             if addr is not None:
-                got = render_address(pubkey, False)
+                # same hash160 for mainnet and testnet; only checksum differs
+                h = hash160(pubkey)
+
+                got = encode_p2wpkh(h, 'bc')
                 if got.endswith(addr):
                     confirmed_addr = got
                     break
 
-                got = render_address(pubkey, True)
+                got = encode_p2wpkh(h, 'tb')
                 if got.endswith(addr):
                     confirmed_addr = got
                     is_testnet = True
@@ -86,6 +160,9 @@ def url_decoder(fragment):
         if addr and not confirmed_addr:
             raise RuntimeError("Could not reconstruct full payment address.")
 
+        if addr and cache is not None and not known:
+            cache.put(('s', addr), (pubkey, confirmed_addr, is_testnet))
+
         rv = dict(state=state, addr=confirmed_addr, nonce=nonce.hex(),
                     is_tapsigner=False,
                     slot_num=slot_num,
@@ -97,4 +174,47 @@ def url_decoder(fragment):
 
         return rv
 
+# each worker process of decode_urls() can have its own cache
+_worker_cache = None
+
+def _init_worker(cache_args):
+    global _worker_cache
+    _worker_cache = IdentityCache(*cache_args) if cache_args else None
+
+def _decode_or_error(fragment, cache=None):
+    # worker side of decode_urls(): exceptions come back as values
+    try:
+        return url_decoder(fragment, cache=(cache if cache is not None else _worker_cache))
+    except Exception as exc:
+        return exc
+
+def decode_urls(fragments, max_workers=None, chunksize=64, cache=None):
+    # Verify many URL fragments (see url_decoder), spread across a process pool.
+    # - generator, yields (fragment, result) in same order as provided
+    # - result is the dict from url_decoder(), or the exception it raised
+    # - max_workers=0 does the work in this process (no pool)
+    # - fragments can be any iterable, and are consumed as we go
+    # - cache: IdentityCache to use; with a pool, each process gets an empty
+    #   one with the same settings since they cannot share memory
+    if max_workers == 0:
+        for frag in fragments:
+            yield frag, _decode_or_error(frag, cache)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    from itertools import islice
+
+    cache_args = (cache.max_size, cache.ttl) if cache is not None else None
+
+    fragments = iter(fragments)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                initargs=(cache_args,)) as pool:
+        # work in batches, so memory use stays bounded for long inputs
+        while 1:
+            batch = list(islice(fragments, chunksize * (max_workers or os.cpu_count() or 1) * 4))
+            if not batch:
+                break
+            for frag, rv in zip(batch, pool.map(_decode_or_error, batch, chunksize=chunksize)):
+                yield frag, rv
 
+# EOF
@@ -69,4 +69,11 @@ def CT_bip32_derive(chain_code, master_priv_pub, subkey_path):
 
     return node.sec()
 
+def CT_pubkey_tweak_add(pubkey, tweak):
+    # pubkey + tweak*G; coincurve raises ValueError itself if invalid
+    return PublicKey(pubkey).add(tweak).format()
+
+def CT_privkey_tweak_add(privkey, tweak):
+    return PrivateKey(privkey).add(tweak).secret
+
 # EOF
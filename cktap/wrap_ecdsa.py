@@ -5,6 +5,7 @@ import os
 from typing import Tuple, List
 
 from cktap._ecdsa import privkey_to_pubkey, ecdsa_verify, ecdsa_recover, ecdsa_sign, ecdh
+from cktap._ecdsa import N, isinf, fast_tweak_add, encode_pubkey, decode_pubkey
 from cktap.bip32 import PrvKeyNode, PubKeyNode
 
 # WRAP
@@ -63,4 +64,26 @@ def CT_bip32_derive(chain_code: bytes, master_priv_pub: bytes, subkey_path: List
     # derive m/0
     node = master.get_extended_pubkey_from_path(subkey_path)
 
-    return node.sec()
\ No newline at end of file
+    return node.sec()
+
+
+def CT_pubkey_tweak_add(pubkey: bytes, tweak: bytes) -> bytes:
+    # return pubkey + tweak*G, compressed 33 bytes
+    t = int.from_bytes(tweak, "big")
+    if t >= N:
+        raise ValueError("tweak out of range")
+    point = fast_tweak_add(decode_pubkey(pubkey, "bin_compressed"), t)
+    if isinf(point):
+        raise ValueError("tweaked pubkey is point at infinity")
+    return encode_pubkey(point, "bin_compressed")
+
+
+def CT_privkey_tweak_add(privkey: bytes, tweak: bytes) -> bytes:
+    # return (privkey + tweak) mod N, 32 bytes
+    t = int.from_bytes(tweak, "big")
+    if t >= N:
+        raise ValueError("tweak out of range")
+    k = (int.from_bytes(privkey, "big") + t) % N
+    if k == 0:
+        raise ValueError("tweaked private key is zero")
+    return k.to_bytes(32, "big")
@@ -7,8 +7,10 @@ from typing import Tuple
 from cktap.bip32 import PrvKeyNode, PubKeyNode
 from pysecp256k1 import (
     ec_seckey_verify, ec_pubkey_create, ec_pubkey_serialize, ecdsa_verify, ecdsa_signature_parse_compact,
-    ec_pubkey_parse, ecdsa_sign, ecdsa_signature_serialize_compact
+    ec_pubkey_parse, ecdsa_sign, ecdsa_signature_serialize_compact,
+    ec_pubkey_tweak_add, ec_seckey_tweak_add
 )
+from pysecp256k1.low_level import Libsecp256k1Exception
 from pysecp256k1.recovery import (
     ecdsa_sign_recoverable, ecdsa_recoverable_signature_serialize_compact, ecdsa_recover,
     ecdsa_recoverable_signature_parse_compact
@@ -96,3 +98,19 @@ def CT_bip32_derive(chain_code, master_priv_pub, subkey_path):
 
     return node.sec()
 
+
+def CT_pubkey_tweak_add(pubkey, tweak):
+    # returns pubkey + tweak*G (33 bytes)
+    try:
+        _pub = ec_pubkey_tweak_add(ec_pubkey_parse(pubkey), tweak)
+    except Libsecp256k1Exception:
+        raise ValueError("tweak out of range, or result is invalid")
+    return ec_pubkey_serialize(_pub, compressed=True)
+
+
+def CT_privkey_tweak_add(privkey, tweak):
+    # returns (privkey + tweak) mod N (32 bytes)
+    try:
+        return ec_seckey_tweak_add(privkey, tweak)
+    except Libsecp256k1Exception:
+        raise ValueError("tweak out of range, or result is invalid")
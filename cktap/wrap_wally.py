@@ -74,4 +74,27 @@ def CT_bip32_derive(chain_code, master_priv_pub, subkey_path):
 
     return bip32_key_get_pub_key(node)
 
+try:
+    # not in older versions of wally: cktap.compat will use another library then
+    from wallycore import ec_public_key_tweak, ec_scalar_add
+
+    def CT_pubkey_tweak_add(pubkey, tweak):
+        try:
+            return bytes(ec_public_key_tweak(pubkey, tweak))
+        except (ValueError, RuntimeError):
+            raise ValueError("tweak out of range, or result is invalid")
+
+    def CT_privkey_tweak_add(privkey, tweak):
+        try:
+            rv = bytes(ec_scalar_add(privkey, tweak))
+        except (ValueError, RuntimeError):
+            raise ValueError("tweak out of range, or result is invalid")
+        if not any(rv):
+            # scalar math is happy with zero, but it's not a private key
+            raise ValueError("tweaked private key is zero")
+        return rv
+
+except ImportError:
+    pass
+
 # EOF
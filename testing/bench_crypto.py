@@ -0,0 +1,211 @@
+#
+# (c) Copyright 2022 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# Benchmark each crypto backend that cktap.compat could pick.
+#
+# Not a pytest file: run directly, from top of the checkout:
+#
+#   python testing/bench_crypto.py                       # all installed backends
+#   python testing/bench_crypto.py -b wally -b ecdsa -k verify
+#   python testing/bench_crypto.py --json report.json    # or --json - for stdout
+#
+# Every CT_* function of cktap.compat is timed, plus the higher-level
+# helpers which depend on them (verify_certs_ll, make_recoverable_sig, url_decoder).
+#
+import os, sys, time, json, platform, argparse
+from contextlib import contextmanager
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import cktap
+import cktap.compat
+from cktap.constants import CARD_NONCE_SIZE, USER_NONCE_SIZE
+
+from cktap.compat import BACKENDS
+
+# real NFC URL fragments, from test_lib.py
+SC_FRAGMENT = 'u=U&o=1&r=mc0gk3l2&n=3efca6c545903a9a&s=a4020efe154842e6f97a363c08463c097da9edc6c5f2e909d4ec4a6605d99b8f3fa44fa9eed5768d562de2f21c85aab6c4b327519ab44c454eb80c6da14e34ec'
+TS_FRAGMENT = 't=1&u=U&c=2c6923818eed775b&n=419a154c57b6f5ab&s=6c9735bc0f9ff2450bb564e2f1bf635789ac303319492f849e0b1978655e1a307efa50205e9c152618d5f75ee36f58b499c09e4ae2237ce3dcb18a664fe6cf16'
+
+@contextmanager
+def forced_backend(name):
+    # Select a backend with set_backend() for the duration.
+    # - raises ImportError if the backend is not installed
+    # - yields cktap.compat, now pointing at the chosen backend
+    compat = cktap.compat
+    prev = compat.get_backend()
+    prev_fns = {fn: compat.get_backend(fn) for fn in compat._FUNCS}
+
+    compat.set_backend(name)
+    try:
+        yield compat
+    finally:
+        compat.set_backend(prev, **prev_fns)
+
+def measure(fn, min_time=1.0, min_runs=5):
+    # Call fn() repeatedly for about min_time seconds, return stats in microseconds
+    fn()        # warm-up, also catches errors before we start timing
+
+    samples = []
+    clock = time.perf_counter_ns
+    end = clock() + int(min_time * 1e9)
+    while len(samples) < min_runs or clock() < end:
+        t0 = clock()
+        fn()
+        samples.append(clock() - t0)
+
+    samples.sort()
+    n = len(samples)
+    pct = lambda p: samples[min(n-1, int(p * n / 100))] / 1000.0
+    total = sum(samples)
+
+    return dict(runs=n, ops_per_sec=round(n * 1e9 / total, 1),
+                mean_us=round(total / n / 1000.0, 2),
+                min_us=round(samples[0] / 1000.0, 2), p50_us=round(pct(50), 2),
+                p90_us=round(pct(90), 2), p99_us=round(pct(99), 2),
+                max_us=round(samples[-1] / 1000.0, 2))
+
+def make_cases(w):
+    # Build the operations to time, with test data made by this backend.
+    # - w is cktap.compat, already switched to the backend under test
+    from cktap import utils
+    from cktap.verify_link import url_decoder
+
+    md = w.sha256s(b'cktap benchmark')
+    priv, pub = w.CT_pick_keypair()
+    priv2, pub2 = w.CT_pick_keypair()
+    sig = w.CT_sign(priv, md)
+    rec_sig = w.CT_sign(priv, md, recoverable=True)
+    chain_code = w.sha256s(b'chain code')
+
+    # fake certificate chain: card <- batch <- root, all signed by us
+    root_priv, root_pub = w.CT_pick_keypair()
+    batch_priv, batch_pub = w.CT_pick_keypair()
+    card_nonce = os.urandom(CARD_NONCE_SIZE)
+    my_nonce = os.urandom(USER_NONCE_SIZE)
+    cert_chain = [w.CT_sign(batch_priv, w.sha256s(pub2), recoverable=True),
+                  w.CT_sign(root_priv, w.sha256s(batch_pub), recoverable=True)]
+    auth_sig = w.CT_sign(priv2, w.sha256s(b'OPENDIME' + card_nonce + my_nonce))
+
+    def verify_certs():
+        with mock.patch.dict(utils.FACTORY_ROOT_KEYS, {bytes(root_pub): 'Benchmark Root'}):
+            return utils.verify_certs_ll(card_nonce, pub2, my_nonce, cert_chain, auth_sig)
+
+    return [
+        ('sha256s', lambda: w.sha256s(md + md)),
+        ('hash160', lambda: w.hash160(pub)),
+        ('CT_pick_keypair', w.CT_pick_keypair),
+        ('CT_priv_to_pubkey', lambda: w.CT_priv_to_pubkey(priv)),
+        ('CT_sign', lambda: w.CT_sign(priv, md)),
+        ('CT_sign(recoverable)', lambda: w.CT_sign(priv, md, recoverable=True)),
+        ('CT_sig_verify', lambda: w.CT_sig_verify(pub, md, sig)),
+        ('CT_sig_to_pubkey', lambda: w.CT_sig_to_pubkey(md, rec_sig)),
+        ('CT_ecdh', lambda: w.CT_ecdh(pub2, priv)),
+        ('CT_bip32_derive', lambda: w.CT_bip32_derive(chain_code, pub, [0])),
+        ('CT_pubkey_tweak_add', lambda: w.CT_pubkey_tweak_add(pub, md)),
+        ('CT_privkey_tweak_add', lambda: w.CT_privkey_tweak_add(priv, md)),
+        ('verify_certs_ll', verify_certs),
+        ('make_recoverable_sig', lambda: utils.make_recoverable_sig(md, sig, expect_pubkey=pub)),
+        ('url_decoder(satscard)', lambda: url_decoder(SC_FRAGMENT)),
+        ('url_decoder(tapsigner)', lambda: url_decoder(TS_FRAGMENT)),
+    ]
+
+def ripemd_cases():
+    # RIPEMD-160 choices, independent of the backend: what compat picked vs. pure python
+    from cktap.ripemd import ripemd160 as pure_ripemd160
+
+    msg = bytes(range(32))
+    rv = [('ripemd160(python)', lambda: pure_ripemd160(msg))]
+    if cktap.compat.RIPEMD160_SOURCE != 'python':
+        rv.append(('ripemd160(%s)' % cktap.compat.RIPEMD160_SOURCE,
+                                lambda: cktap.compat.ripemd160(msg)))
+    return rv
+
+def bip32_cases():
+    # xpub handling, mostly independent of the backend
+    from cktap.bip32 import PubKeyNode, _decode_xpub
+    from cktap.base58 import decode_base58_checksum
+
+    xpub = "xpub69H7F5d8KSRgmmdJg2KhpAK8SR3DjMwAdkxj3ZuxV27CprR9LgpeyGmXUbC6wb7ERfvrnKZjXoUmmDznezpbZb7ap6r1D3tgFxHmwMkQTPH"
+    raw = decode_base58_checksum(xpub)
+    node = PubKeyNode.parse(xpub)
+
+    def uncached():
+        _decode_xpub.cache_clear()
+        return PubKeyNode.parse(xpub)
+
+    return [
+        ('xpub parse(cached)', lambda: PubKeyNode.parse(xpub)),
+        ('xpub parse(uncached)', uncached),
+        ('xpub parse(bytes)', lambda: PubKeyNode.parse(raw)),
+        ('serialize_public', node.serialize_public),
+        ('extended_public_key', node.extended_public_key),
+    ]
+
+def _report_rows(cases, min_time, match, quiet):
+    rows = {}
+    for label, fn in cases:
+        if match and match not in label:
+            continue
+        rows[label] = st = measure(fn, min_time)
+        if not quiet:
+            print(f"{label:>24}: {st['ops_per_sec']:>10.1f} ops/sec"
+                  f"  p50 {st['p50_us']:>9.1f}us  p99 {st['p99_us']:>9.1f}us")
+    return rows
+
+def run(backends, min_time=1.0, match=None, quiet=False):
+    # Returns report as a dict, suitable for JSON
+    report = dict(cktap_version=cktap.__version__,
+                  python=platform.python_version(),
+                  implementation=platform.python_implementation(),
+                  machine=platform.machine(), system=platform.system(),
+                  timestamp=int(time.time()),
+                  results={})
+
+    if not quiet:
+        print("\n== ripemd160 ==")
+    report['ripemd160'] = _report_rows(ripemd_cases(), min_time, match, quiet)
+
+    if not quiet:
+        print("\n== bip32 ==")
+    report['bip32'] = _report_rows(bip32_cases(), min_time, match, quiet)
+
+    for name in backends:
+        try:
+            with forced_backend(name) as compat:
+                if not quiet:
+                    print(f"\n== {name} ==")
+                report['results'][name] = _report_rows(make_cases(compat),
+                                                            min_time, match, quiet)
+        except ImportError as exc:
+            if not quiet:
+                print(f"\n== {name} == (not installed: {exc})")
+            report['results'][name] = None
+
+    return report
+
+def main():
+    p = argparse.ArgumentParser(description='Benchmark cktap crypto backends')
+    p.add_argument('-b', '--backend', action='append', choices=list(BACKENDS),
+                    help='backend(s) to test, default: all installed')
+    p.add_argument('-t', '--time', type=float, default=1.0,
+                    help='seconds to spend on each operation')
+    p.add_argument('-k', dest='match', help='only operations containing this text')
+    p.add_argument('--json', metavar='FILE', help="write JSON report, '-' for stdout")
+    args = p.parse_args()
+
+    report = run(args.backend or list(BACKENDS), args.time, args.match,
+                    quiet=(args.json == '-'))
+
+    if args.json == '-':
+        json.dump(report, sys.stdout, indent=2)
+        print()
+    elif args.json:
+        with open(args.json, 'wt') as fd:
+            json.dump(report, fd, indent=2)
+
+if __name__ == '__main__':
+    main()
+
+# EOF
@@ -7,6 +7,17 @@ def pytest_addoption(parser):
     parser.addoption("--cvc", action="store", type=str,
                      default=None, help="CVC for card under test")
 
+@pytest.fixture(autouse=True)
+def esplora_cache_dir(tmp_path, monkeypatch):
+    # never let tests read or write the developer's own cache of server responses
+    from cktap import sweep
+
+    path = str(tmp_path / 'esplora-cache')
+    monkeypatch.setenv('CKTAP_CACHE_DIR', path)
+    monkeypatch.setattr(sweep, 'CACHE_DIR', path)
+    monkeypatch.setattr(sweep, '_connections', {})
+    return path
+
 @pytest.fixture(scope='session')
 def dev():
     # a connected card (via USB to NFC reader) .. or the emulator
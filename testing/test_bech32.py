@@ -192,3 +192,17 @@ class TestSegwitAddress(unittest.TestCase):
         for hrp, version, length in INVALID_ADDRESS_ENC:
             code = segwit_addr.encode(hrp, version, [0] * length)
             self.assertIsNone(code)
+
+    def test_p2wpkh_many(self):
+        """Test bulk P2WPKH encoder against the generic one."""
+        import os
+        hashes = [bytes.fromhex(VALID_ADDRESS[0][1])[2:], bytes(20), b'\xff' * 20]
+        hashes += [os.urandom(20) for _ in range(50)]
+        for hrp in ["bc", "tb", "bcrt"]:
+            expect = [segwit_addr.encode(hrp, 0, list(h)) for h in hashes]
+            self.assertEqual(segwit_addr.encode_p2wpkh_many(hashes, hrp), expect)
+            self.assertEqual(segwit_addr.encode_p2wpkh(hashes[0], hrp), expect[0])
+        self.assertEqual(segwit_addr.encode_p2wpkh_many(hashes[:1], "bc")[0],
+                         VALID_ADDRESS[0][0].lower())
+        with self.assertRaises(ValueError):
+            segwit_addr.encode_p2wpkh(bytes(32), "bc")
@@ -303,3 +303,132 @@ def test_sk_33_bytes():
     expected_prv = "tprv8iLpePsASCsBdn2zucoKhSkSCvcBT4sNHB2vYQVTHcQK6v8pzse7wmYFxFzisGQ5affBk4Whg1qoQrX5jTkzQy3ENjE89KkiBWkbd9RE9Ez"
     assert sk.extended_public_key() == expected_pub
     assert sk.extended_private_key() == expected_prv
+
+
+def test_prv_sec_native(monkeypatch):
+    # private derivation uses the crypto backend for public keys, not pure python
+    from cktap import compat, _ecdsa
+    if compat.get_backend('CT_priv_to_pubkey') == 'ecdsa':
+        pytest.skip("no native crypto backend")
+
+    xpriv = "xprv9s21ZrQH143K3YFDmG48xQj4BKHUn15if4xsQiMwSKX8bZ6YruYK6mV6oM5Tbodv1pLF7GMdPGaTcZBno3ZejMHbVVvymhsS5GcYC4hSKag"
+    expect = PrvKeyNode.parse(xpriv).get_extended_pubkey_from_path([1, 2**31 + 5, 7])
+
+    def nope(*a):
+        raise AssertionError("pure python EC math")
+    monkeypatch.setattr(_ecdsa, 'jacobian_multiply_g', nope)
+    monkeypatch.setattr(_ecdsa, 'jacobian_multiply', nope)
+
+    node = PrvKeyNode.parse(xpriv).get_extended_pubkey_from_path([1, 2**31 + 5, 7])
+    assert node.extended_private_key() == expect.extended_private_key()
+    assert node.extended_public_key() == expect.extended_public_key()
+    assert node.sec() == compat.CT_priv_to_pubkey(node.key[-32:])
+
+    # point is only decoded from that when asked for
+    assert node._point is None
+    assert encode_pubkey(node.public_key, "bin_compressed") == node.sec()
+
+
+@pytest.mark.parametrize('cls', [PubKeyNode, PrvKeyNode])
+def test_child_cache(cls):
+    xpriv = "xprv9s21ZrQH143K4EK4Fdy4ddWeDMy1x4tg2s292J5ynk23sn3hxSZ9MqqLZCTj2dHPP16CsTdAFeznbnNhSN3v66TtSKzJf4hPZSqDjjp9t42"
+    xpub = PrvKeyNode.parse(xpriv).extended_public_key()
+    node = cls.parse(xpriv if cls is PrvKeyNode else xpub)
+    node.cache_size = 3
+
+    a = node.get_extended_pubkey_from_path([0, 5])
+    assert node.get_extended_pubkey_from_path([0, 5]) is a
+    assert node.children[0].cache_size == 3
+
+    # least recently used is dropped, results stay the same
+    for i in range(1, 4):
+        node.ckd(i)
+    assert list(node.children) == [1, 2, 3]
+    b = node.get_extended_pubkey_from_path([0, 5])
+    assert b is not a and b == a
+    assert list(node.children) == [2, 3, 0]
+
+    # no cache at all
+    node = cls.parse(xpriv if cls is PrvKeyNode else xpub)
+    node.cache_size = 0
+    assert node.ckd(7) == node.ckd(7)
+    assert not node.children
+
+
+def test_iter_addresses():
+    from cktap.utils import render_address
+
+    xpub = "xpub69H7F5d8KSRgmmdJg2KhpAK8SR3DjMwAdkxj3ZuxV27CprR9LgpeyGmXUbC6wb7ERfvrnKZjXoUmmDznezpbZb7ap6r1D3tgFxHmwMkQTPH"
+    node = PubKeyNode.parse(xpub)
+    for branch in (0, 1):
+        got = list(node.iter_addresses(branch, start=5, count=10))
+        assert [i for i, _, _ in got] == list(range(5, 15))
+        for idx, pubkey, addr in got:
+            expect = node.get_extended_pubkey_from_path([branch, idx]).sec()
+            assert pubkey == expect
+            assert addr == render_address(expect)
+
+    tb = next(node.iter_addresses(0, testnet=True))
+    assert tb[2].startswith('tb1q')
+
+    # private nodes give same answers
+    xpriv = "xprv9vHkqa6EV4sPZHYqZznhT2NPtPCjKuDKGY38FBWLvgaDx45zo9WQRUT3dKYnjwih2yJD9mkrocEZXo1ex8G81dwSM1fwqWpWkeS3v86pgKt"
+    assert list(PrvKeyNode.parse(xpriv).iter_addresses(0, count=3)) \
+                == list(node.iter_addresses(0, count=3))
+
+    with pytest.raises(RuntimeError):
+        next(node.iter_addresses(2**31))
+
+
+def test_node_keeps_no_ancestry():
+    import gc
+
+    seed = "fffcf9f6f3f0edeae7e4e1dedbd8d5d2cfccc9c6c3c0bdbab7b4b1aeaba8a5a29f9c999693908d8a8784817e7b7875726f6c696663605d5a5754514e4b484542"
+    m = PrvKeyNode.master_key(bip39_seed=bytes.fromhex(seed))
+    M = PubKeyNode.parse(m.extended_public_key())
+    child = M.get_extended_pubkey_from_path([0, 1, 2])
+    assert repr(child) == "M/0/1/2"
+    assert repr(m.get_extended_pubkey_from_path([2**31 + 44, 0])) == "m/44'/0"
+    assert not child.is_root() and not child.is_master()
+    assert M.is_master() and M.is_root()
+
+    # serialized form unchanged: parent fingerprint still right
+    mid = M.ckd(0).ckd(1)
+    assert child.parent_fingerprint == mid.fingerprint()
+    assert PubKeyNode.parse(child.extended_public_key()) == child
+
+    # derived nodes don't hold their parents
+    assert not any(isinstance(r, PubKeyNode) for r in gc.get_referents(child))
+
+    # cached values
+    assert child.fingerprint() is child.fingerprint()
+    assert child.public_key is child.public_key
+
+
+def test_parse_fast_paths():
+    from cktap.bip32 import _decode_xpub
+
+    xpub = "xpub69H7F5d8KSRgmmdJg2KhpAK8SR3DjMwAdkxj3ZuxV27CprR9LgpeyGmXUbC6wb7ERfvrnKZjXoUmmDznezpbZb7ap6r1D3tgFxHmwMkQTPH"
+    raw = decode_base58_checksum(xpub)
+
+    a = PubKeyNode.parse(xpub)
+    b = PubKeyNode.parse(xpub)
+    assert a == b and a is not b       # fresh node, even when decode is cached
+    assert _decode_xpub.cache_info().hits >= 1
+
+    for buf in (raw, bytearray(raw), memoryview(raw), BytesIO(raw), raw + b'extra'):
+        node = PubKeyNode.parse(buf)
+        assert node == a
+        assert type(node.key) is bytes and type(node.chain_code) is bytes
+        assert node.serialize_public() == raw
+        assert node.extended_public_key() == xpub
+
+    with pytest.raises(ValueError):
+        PubKeyNode.parse(raw[:-1])
+
+    # private keys stay out of the cache
+    xpriv = "xprv9vHkqa6EV4sPZHYqZznhT2NPtPCjKuDKGY38FBWLvgaDx45zo9WQRUT3dKYnjwih2yJD9mkrocEZXo1ex8G81dwSM1fwqWpWkeS3v86pgKt"
+    before = _decode_xpub.cache_info().currsize
+    assert PrvKeyNode.parse(xpriv).extended_public_key() == xpub
+    PubKeyNode.parse(xpriv)
+    assert _decode_xpub.cache_info().currsize == before
@@ -334,3 +334,166 @@ def test_bip32_derivation():
         pk_wally = bip32_wally(chain_code, pubkey, path)
         all_pks = [pk for pk in [pk_wally, pk_ecdsa] if pk is not None]  # filter out None results of unavailable libs
         assert all([pk == expected_pk for pk in all_pks])
+
+
+def test_ecdsa_point_math():
+    # windowed and fixed-base multiply must agree with plain double-and-add
+    from cktap._ecdsa import G, N, fast_multiply, fast_add, fast_tweak_add
+    from cktap._ecdsa import jacobian_add, jacobian_double, from_jacobian, decode_pubkey
+
+    def naive(point, n):
+        acc = (0, 0, 1)
+        add = (point[0], point[1], 1)
+        while n:
+            if n & 1:
+                acc = jacobian_add(acc, add)
+            add = jacobian_double(add)
+            n >>= 1
+        return from_jacobian(acc)
+
+    scalars = [1, 2, 15, 16, 17, 255, N - 1, N - 2, 2**255 + 12345] \
+                + [int.from_bytes(sk, 'big') for sk in sk_list]
+    other = decode_pubkey(expected_pks[0])
+    for n in scalars:
+        assert fast_multiply(G, n) == naive(G, n)
+        assert fast_multiply(other, n) == naive(other, n)
+        assert fast_tweak_add(other, n) == fast_add(other, naive(G, n))
+
+    # reduction mod N and the point at infinity
+    assert fast_multiply(G, N + 5) == fast_multiply(G, 5)
+    assert fast_multiply(G, 0) == (0, 0)
+    assert fast_multiply(G, N) == (0, 0)
+    assert fast_tweak_add(G, N - 1) == (0, 0)
+
+    # combined u1*G + u2*Q, including when result is a doubling or infinity
+    from cktap._ecdsa import jacobian_multiply_add
+    for u1, u2 in zip(scalars, reversed(scalars)):
+        expect = fast_add(naive(G, u1), naive(other, u2))
+        assert from_jacobian(jacobian_multiply_add(u1, other, u2)) == expect
+    assert from_jacobian(jacobian_multiply_add(5, G, 3)) == naive(G, 8)
+    assert jacobian_multiply_add(5, G, N - 5)[1] == 0
+    assert from_jacobian(jacobian_multiply_add(0, other, 7)) == naive(other, 7)
+
+
+def test_ecdsa_scalar_split():
+    # GLV split and wNAF digits both reconstruct the scalar
+    from cktap._ecdsa import N, P, G, LAMBDA, BETA, split_scalar, wnaf, fast_multiply
+
+    assert fast_multiply(G, LAMBDA) == ((BETA * G[0]) % P, G[1])
+
+    for k in [0, 1, 2, LAMBDA, N - 1, 2**255 + 1] + [int.from_bytes(sk, 'big') for sk in sk_list]:
+        k1, k2 = split_scalar(k)
+        assert (k1 + k2 * LAMBDA - k) % N == 0
+        assert abs(k1) < 2**129 and abs(k2) < 2**129
+
+        for w in (5, 8):
+            for v in (k1, k2, k):
+                digits = wnaf(v, w)
+                assert sum(d << i for i, d in enumerate(digits)) == v
+                nz = [i for i, d in enumerate(digits) if d]
+                assert all(d % 2 and abs(d) < (1 << (w-1)) for d in digits if d)
+                assert all(b - a >= w for a, b in zip(nz, nz[1:]))
+
+
+def test_ecdsa_verify_recover():
+    from cktap._ecdsa import ecdsa_sign, ecdsa_verify, ecdsa_recover, decode_sig, encode_sig, N
+
+    for sk, pk, msg in zip(sk_list, expected_pks, msg_digest_list):
+        sig = ecdsa_sign(msg, sk)
+        assert ecdsa_verify(msg, sig, pk)
+        assert ecdsa_recover(msg, sig) == pk
+
+        # wrong message, wrong key, out of range values
+        assert not ecdsa_verify(bytes(32), sig, pk)
+        assert not ecdsa_verify(msg, sig, expected_pks[-1] if pk != expected_pks[-1] else expected_pks[0])
+        v, r, s = decode_sig(sig)
+        assert not ecdsa_verify(msg, encode_sig(v, 0, s), pk)
+        assert not ecdsa_verify(msg, encode_sig(v, r, 0), pk)
+
+
+def test_set_backend():
+    # every installed backend can be selected at runtime, and is used by other modules
+    from cktap import compat
+    from cktap.utils import CT_sig_verify as imported_verify
+
+    prev = compat.get_backend()
+    prev_fns = {fn: compat.get_backend(fn) for fn in compat._FUNCS}
+    try:
+        tried = 0
+        for name in compat.BACKENDS:
+            try:
+                compat.set_backend(name)
+            except ImportError:
+                continue
+            tried += 1
+            assert compat.get_backend() == name
+            assert compat.get_backend('CT_sign') == name
+
+            pk, pub = compat.CT_pick_keypair()
+            sig = compat.CT_sign(pk, bytes(32))
+            assert imported_verify(pub, bytes(32), sig)
+            assert compat.hash160(b'abc') == \
+                    b'\xbb\x1b\xe9\x8c\x14$D\xd7\xa5j\xa3\x98\x1c9B\xa9x\xe4\xdc3'
+        assert tried
+
+        # per-function choice
+        compat.set_backend('ecdsa', hash160='builtin')
+        assert compat.get_backend('hash160') == 'builtin'
+        assert compat.get_backend('CT_ecdh') == 'ecdsa'
+
+        with pytest.raises(ValueError):
+            compat.set_backend('openssl')
+        with pytest.raises(ValueError):
+            compat.set_backend('ecdsa', CT_foo='ecdsa')
+        # failed calls change nothing
+        assert compat.get_backend() == 'ecdsa'
+    finally:
+        compat.set_backend(prev, **prev_fns)
+
+
+def test_ripemd160_sources():
+    # whichever RIPEMD-160 compat found must match the pure python one
+    from cktap import compat
+    from cktap.ripemd import ripemd160, RIPEMD160
+
+    assert compat.RIPEMD160_SOURCE in ('hashlib', 'wally', 'python')
+    for msg in [b'', b'abc', bytes(33), bytes(range(64)), b'a' * 1000]:
+        assert compat.ripemd160(msg) == ripemd160(msg)
+        assert compat._builtin_hash160(msg) == ripemd160(compat.sha256s(msg))
+
+        # streaming interface, fed in odd-sized pieces
+        h = RIPEMD160()
+        for pos in range(0, len(msg), 7):
+            h.update(memoryview(msg)[pos:pos+7])
+        assert h.copy().digest() == compat.ripemd160(msg)
+        h.update(b'x')
+        assert h.hexdigest() == compat.ripemd160(msg + b'x').hex()
+
+
+def test_tweak_add():
+    # all backends agree on key tweaking, and reject bad tweaks the same way
+    from cktap import compat, wrap_ecdsa
+    from cktap._ecdsa import N
+
+    prev = compat.get_backend()
+    prev_fns = {fn: compat.get_backend(fn) for fn in compat._FUNCS}
+    try:
+        for name in compat.BACKENDS:
+            try:
+                compat.set_backend(name)
+            except ImportError:
+                continue
+            for sk, pk, tweak in zip(sk_list, expected_pks, msg_digest_list):
+                exp_pub = wrap_ecdsa.CT_pubkey_tweak_add(pk, tweak)
+                exp_priv = wrap_ecdsa.CT_privkey_tweak_add(sk, tweak)
+                assert compat.CT_pubkey_tweak_add(pk, tweak) == exp_pub
+                assert compat.CT_privkey_tweak_add(sk, tweak) == exp_priv
+                assert compat.CT_priv_to_pubkey(exp_priv) == exp_pub
+
+            with pytest.raises(ValueError):
+                compat.CT_pubkey_tweak_add(expected_pks[0], N.to_bytes(32, 'big'))
+            with pytest.raises(ValueError):
+                neg = (N - int.from_bytes(sk_list[0], 'big')).to_bytes(32, 'big')
+                compat.CT_privkey_tweak_add(sk_list[0], neg)
+    finally:
+        compat.set_backend(prev, **prev_fns)
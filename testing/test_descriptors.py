@@ -1,7 +1,9 @@
 #
 # (c) Copyright 2022 by Coinkite Inc. This file is covered by license found in COPYING-CC.
 #
+import pytest
 from cktap.descriptors import descsum_create, descsum_check
+from cktap.descriptors import DescriptorChecksum, descsum_create_many
 
 
 def test_simple_descsum_check():
@@ -13,3 +15,31 @@ def test_simple_descsum_check():
         assert d_w_sum == expected
         assert descsum_check(d_w_sum)
 
+
+def test_incremental_descsum():
+    d = "wpkh([0f056943/84h/1h/0h]tpubDC7jGaaSE66Pn4dgtbAAstde4bCyhSUs4r3P8WhMVvPByvcRrzrwqSvpF9Ghx83Z1LfVugGRrSBko5UEKELCz9HoMv5qKmGq3fqnnbS5E9r/0/*)"
+    expect = descsum_create(d).split('#')[1]
+
+    # any split gives same answer, and checksum() can be read part way
+    for n in range(len(d)+1):
+        h = DescriptorChecksum(d[:n])
+        assert h.checksum() == descsum_create(d[:n]).split('#')[1]
+        assert h.update(d[n:]).checksum() == expect
+
+    # copies are independent
+    base = DescriptorChecksum('wpkh(')
+    a = base.copy().update(d[5:])
+    assert a.checksum() == expect
+    assert base.checksum() == descsum_create('wpkh(').split('#')[1]
+
+    with pytest.raises(ValueError):
+        DescriptorChecksum('wpkh(\n)')
+    assert not descsum_check('wpkh(\n)#2kyyxsrc')
+
+def test_descsum_create_many():
+    keys = ["cU7CGBhwnMdLDbqBaXm3xE22KFyaA5s3YDBis88LyuPLnmfpDFFU", "02" + "ab"*32, ""]
+    expect = [descsum_create('wpkh(%s)' % k) for k in keys]
+
+    assert descsum_create_many(['wpkh(%s)' % k for k in keys]) == expect
+    assert descsum_create_many([k + ')' for k in keys], prefix='wpkh(') == expect
+    assert expect[0] == 'wpkh(cU7CGBhwnMdLDbqBaXm3xE22KFyaA5s3YDBis88LyuPLnmfpDFFU)#2kyyxsrc'
@@ -31,4 +31,46 @@ def test_paths(case):
         str2path("m/84h/-1h/0h")
     assert err.value.args[0] == 'Hardened path component out of range: -1h'
 
+# from Bitcoin Core: src/test/data/base58_encode_decode.json
+@pytest.mark.parametrize('hex_data, b58', [
+    ("", ""),
+    ("61", "2g"),
+    ("626262", "a3gV"),
+    ("636363", "aPEr"),
+    ("73696d706c792061206c6f6e6720737472696e67", "2cFupjhnEsSn59qHXstmK2ffpLv2"),
+    ("00eb15231dfceb60925886b67d065299925915aeb172c06647", "1NS17iag9jJgTHD1VXjvLCEnZuQ3rJDE9L"),
+    ("516b6fcd0f", "ABnLTmg"),
+    ("bf4f89001e670274dd", "3SEo3LWLoPntC"),
+    ("572e4794", "3EFU7m"),
+    ("ecac89cad93923c02321", "EJDM8drfXA6uyA"),
+    ("10c8511e", "Rt5zm"),
+    ("00000000000000000000", "1111111111"),
+])
+def test_base58(hex_data, b58):
+    from cktap.base58 import encode_base58, decode_base58
+
+    assert encode_base58(bytes.fromhex(hex_data)) == b58
+    assert decode_base58(b58) == bytes.fromhex(hex_data)
+
+    # any bytes-like object
+    raw = bytearray.fromhex(hex_data)
+    assert encode_base58(raw) == encode_base58(memoryview(raw)) == b58
+
+def test_base58_checksum():
+    import os
+    from cktap.base58 import encode_base58_checksum, decode_base58_checksum, bulk_encode_checksum
+
+    items = [os.urandom(n) for n in range(100)] + [bytes(5), b'\x00\x01' + os.urandom(78)]
+    encoded = bulk_encode_checksum(iter(items))
+    assert encoded == [encode_base58_checksum(i) for i in items]
+    assert [decode_base58_checksum(e) for e in encoded] == items
+    views = [memoryview(b'..' + i)[2:] for i in items]
+    assert [encode_base58_checksum(v) for v in views] == encoded
+    assert bulk_encode_checksum(views) == encoded
+
+    with pytest.raises(ValueError):
+        decode_base58_checksum(encoded[50][:-1] + ('2' if encoded[50][-1] != '2' else '3'))
+    with pytest.raises(ValueError):
+        decode_base58_checksum('0OIl')
+
 # EOF
@@ -45,6 +45,35 @@ def test_wrap():
     ss = CT_ecdh(pub, pk)
     assert ss == b'\x10L^\xf4iY\x01<\xc5*.jZ\xcc&\xb97\xf7\xcf\x91\x0f\r\x80O{\xf2x\xef\x1e\xb2\xd9\xed'
 
+def test_session_key_pool():
+    from cktap.utils import SessionKeyPool
+
+    card_priv, card_pub = CT_pick_keypair()
+    pool = SessionKeyPool(card_pub, size=2)
+    try:
+        seen = set()
+        for i in range(5):
+            # more than pool size, so some are made on the spot
+            session_key, my_pub = pool.take()
+            assert bytes(my_pub) not in seen
+            seen.add(bytes(my_pub))
+
+            # card would compute same session key
+            assert CT_ecdh(my_pub, card_priv) == session_key
+    finally:
+        pool.close()
+
+@pytest.mark.device
+def test_key_pool_auth(dev, known_cvc):
+    dev.start_key_pool()
+    try:
+        for _ in range(3):
+            md = sha256s(os.urandom(32))
+            assert len(dev.sign_digest(cvc=known_cvc, digest=md)) == 65
+    finally:
+        dev.key_pool.close()
+        dev.key_pool = None
+
 
 @pytest.mark.device
 def test_addr(dev, known_cvc):
@@ -86,6 +115,55 @@ def test_addr(dev, known_cvc):
             dev.certificate_check(None)
 
 
+@pytest.mark.device
+def test_async_card(dev):
+    # asyncio front-end gives same answers as blocking calls
+    import asyncio
+    from cktap.aio import AsyncCKTapCard
+
+    async def doit():
+        card = AsyncCKTapCard(dev)
+        assert card.card_ident == dev.card_ident
+        st = await card.send('status')
+        assert st['pubkey'] == dev.card_pubkey
+        assert await card.get_nfc_url()
+
+        # give it back, still usable
+        assert await card.detach() is dev
+
+    asyncio.run(doit())
+
+
+@pytest.mark.device
+def test_status_cache(dev):
+    # helpers reuse last status response until something could change it
+    sent = []
+    orig_send = dev.tr.send
+    def spy(cmd, **args):
+        sent.append(cmd)
+        return orig_send(cmd, **args)
+
+    dev.tr.send = spy
+    try:
+        dev.send('status')
+        a = dev._get_status()
+        b = dev._get_status()
+        assert sent == ['status']
+        assert a == b
+        assert a['card_nonce'] == dev.card_nonce
+
+        # errors (and unknown commands) forget it
+        dev.send('bogus', raise_on_error=False)
+        dev._get_status()
+        assert sent == ['status', 'bogus', 'status']
+
+        dev.cache_status = False
+        dev._get_status()
+        assert sent[-1] == 'status' and len(sent) == 4
+    finally:
+        dev.cache_status = True
+        del dev.tr.send
+
 @pytest.mark.device
 def test_status_fields(dev):
     st = dev.send('status')
@@ -200,6 +278,36 @@ def test_sign_digest(dev, known_cvc):
     assert err.value.args[0] == "Digest must be exactly 32 bytes"
 
 
+@pytest.mark.device
+def test_sign_digests(dev, known_cvc):
+    if not dev.is_tapsigner:
+        try:
+            dev.unseal_slot(known_cvc)
+        except:
+            # was unsealed in previous run
+            pass
+
+    subpaths = [None] * 5
+    if dev.is_tapsigner:
+        subpaths += [f"{i}/{i+100}" for i in range(5)]
+
+    digests = [sha256s(os.urandom(32)) for _ in subpaths]
+    got = dev.sign_digests(known_cvc, zip(digests, subpaths))
+    assert len(got) == len(digests)
+
+    for md, (sig, elapsed) in zip(digests, got):
+        assert len(sig) == 65
+        assert elapsed > 0
+        # must be signature over the digest at same position
+        assert CT_sig_verify(CT_sig_to_pubkey(md, sig), md, sig[1:])
+
+    if dev.is_tapsigner:
+        # nothing gets signed if any item is bad
+        with pytest.raises(ValueError) as err:
+            dev.sign_digests(known_cvc, [(digests[0], None), (digests[1], "0/0/0")])
+        assert err.value.args[0] == 'Length of subpath 0/0/0 is greater than 2'
+
+
 @pytest.mark.satscard
 @pytest.mark.device
 def test_dump_unauth(dev):
@@ -371,6 +479,52 @@ def test_url_decoder_ts():
     assert r['virgin'] == True
     assert r['tampered'] == False
 
+def test_url_decoder_cache(monkeypatch):
+    import cktap.verify_link as vl
+
+    sc = 'u=U&o=1&r=mc0gk3l2&n=3efca6c545903a9a&s=a4020efe154842e6f97a363c08463c097da9edc6c5f2e909d4ec4a6605d99b8f3fa44fa9eed5768d562de2f21c85aab6c4b327519ab44c454eb80c6da14e34ec'
+    ts = 't=1&u=U&c=2c6923818eed775b&n=419a154c57b6f5ab&s=6c9735bc0f9ff2450bb564e2f1bf635789ac303319492f849e0b1978655e1a307efa50205e9c152618d5f75ee36f58b499c09e4ae2237ce3dcb18a664fe6cf16'
+
+    cache = vl.IdentityCache(max_size=10)
+    expect = [url_decoder(f, cache=cache) for f in (sc, ts)]
+    assert len(cache) == 2
+
+    # repeat taps must not need pubkey recovery
+    def no_search(sig, md):
+        raise AssertionError('should use cache')
+    monkeypatch.setattr(vl, 'all_keys', no_search)
+
+    assert [url_decoder(f, cache=cache) for f in (sc, ts)] == expect
+
+    # LRU limit
+    small = vl.IdentityCache(max_size=1)
+    small.put('a', 1)
+    small.put('b', 2)
+    assert small.get('a') is None and small.get('b') == 2
+
+    # expired entries are ignored
+    old = vl.IdentityCache(ttl=-1)
+    old.put('a', 1)
+    assert old.get('a') is None
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_decode_urls(workers):
+    from cktap.verify_link import decode_urls
+
+    sc = 'u=U&o=1&r=mc0gk3l2&n=3efca6c545903a9a&s=a4020efe154842e6f97a363c08463c097da9edc6c5f2e909d4ec4a6605d99b8f3fa44fa9eed5768d562de2f21c85aab6c4b327519ab44c454eb80c6da14e34ec'
+    ts = 't=1&u=U&c=2c6923818eed775b&n=419a154c57b6f5ab&s=6c9735bc0f9ff2450bb564e2f1bf635789ac303319492f849e0b1978655e1a307efa50205e9c152618d5f75ee36f58b499c09e4ae2237ce3dcb18a664fe6cf16'
+    bad = sc.replace('r=mc0gk3l2', 'r=mc0gk3l3')
+
+    frags = [sc, ts, bad] * 3
+    got = list(decode_urls(iter(frags), max_workers=workers, chunksize=2))
+    assert [f for f,_ in got] == frags
+
+    for frag, rv in got:
+        if frag == bad:
+            assert isinstance(rv, Exception)
+        else:
+            assert rv == url_decoder(frag)
+
 def test_nonce_quality():
     from cktap.utils import pick_nonce
 
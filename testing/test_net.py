@@ -2,7 +2,12 @@
 # (c) Copyright 2021 by Coinkite Inc. This file is covered by license found in COPYING-CC.
 #
 #
-from cktap.sweep import NetConnection, UTXO, UTXOList
+import time, json, socket, threading
+import pytest
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from cktap import sweep
+from cktap.sweep import NetConnection, UTXO, UTXOList, get_connection, fetch_all
+from cktap.sweep import find_tor_port, set_tor_port, probe_socks5
 
 def test_useragent():
     a = NetConnection('http://httpbin.org')
@@ -18,4 +23,325 @@ def test_fetch():
     ul.fetch()
     assert ul.confirmed_balance() == 719_394
 
+class FakeWeb(NetConnection):
+    # canned Esplora answers, slow enough to show any lack of concurrency
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.paths = []
+        self.lock = threading.Lock()
+
+    def get_json(self, path, **kws):
+        with self.lock:
+            self.paths.append(path)
+        time.sleep(self.delay)
+        if path.endswith('/utxo'):
+            addr = path.split('/')[-2]
+            return [dict(txid=addr[-4:]*16, vout=n, value=1000+n,
+                            status=dict(confirmed=bool(n), block_height=100))
+                        for n in range(2)]
+        return dict(txid=path.split('/')[-1])
+
+def test_shared_connection():
+    a = get_connection()
+    assert get_connection() is a
+    assert get_connection('http://example.com') is not a
+    assert UTXOList('tb1qsomething').web is a
+
+def test_concurrent_fetch():
+    web = FakeWeb()
+    lists = [UTXOList('tb1qaddress%04d' % n, slot_num=n, web=web) for n in range(10)]
+
+    start = time.monotonic()
+    assert fetch_all(lists) == lists
+    assert time.monotonic() - start < 5 * web.delay
+    assert len(web.paths) == 10
+
+    for n, ul in enumerate(lists):
+        assert ul.slot == n
+        assert ul.confirmed_balance() == 1001
+        assert ul.unconfirmed_balance() == 1000
+
+    # again: no duplicates
+    lists[0].fetch()
+    assert len(lists[0].utxos) == 2
+
+    web.paths.clear()
+    ul = UTXOList('tb1qmany', web=web)
+    ul.utxos = [UTXO('%064x' % n, 0, 1, 1, True) for n in range(20)]
+    txns = ul.fetch_txns()
+    assert len(web.paths) == 20
+    assert all(k == v['txid'] for k, v in txns.items())
+    assert all(p.startswith('/testnet/api/tx/') for p in web.paths)
+
+@pytest.fixture
+def fake_tor(monkeypatch):
+    # listens like a SOCKS5 proxy: accepts the no-auth greeting; yields port number
+    srv = socket.create_server(('127.0.0.1', 0))
+    port = srv.getsockname()[1]
+
+    def serve():
+        while 1:
+            try:
+                conn, _ = srv.accept()
+            except OSError:
+                return
+            with conn:
+                if conn.recv(3) == b'\x05\x01\x00':
+                    conn.sendall(b'\x05\x00')
+
+    threading.Thread(target=serve, daemon=True).start()
+
+    # a closed port, then our fake proxy
+    closed = socket.create_server(('127.0.0.1', 0))
+    closed_port = closed.getsockname()[1]
+    closed.close()
+    monkeypatch.setattr(sweep, 'LOCALHOST_PROXY_PORTS', [closed_port, port])
+
+    set_tor_port(None)
+    yield port
+    set_tor_port(None)
+    srv.close()
+
+def test_tor_detect(fake_tor, monkeypatch):
+    assert probe_socks5(fake_tor)
+    assert find_tor_port() == fake_tor
+
+    # cached: no probing now
+    calls = []
+    monkeypatch.setattr(sweep, 'probe_socks5', lambda p: calls.append(p))
+    assert find_tor_port() == fake_tor
+    assert calls == []
+
+    # until expired, or asked to
+    assert find_tor_port(refresh=True) == None
+    assert len(calls) == 2
+    monkeypatch.setattr(time, 'monotonic', lambda real=time.monotonic: real() + sweep.TOR_CACHE_TTL)
+    assert find_tor_port() == None
+    assert len(calls) == 4
+
+    # overrides
+    set_tor_port(1234)
+    assert find_tor_port() == 1234
+    set_tor_port(False)
+    assert find_tor_port() == None
+    assert len(calls) == 4
+
+def test_tor_connections(fake_tor, monkeypatch):
+    # shared connections follow the Tor setting
+    pytest.importorskip('socks')
+    for v in ('HTTP_PROXY', 'HTTPS_PROXY'):
+        monkeypatch.delenv(v, raising=False)
+
+    a = get_connection('http://example.com')
+    assert a.is_tor
+    assert str(fake_tor) in a.ses.proxies['https']
+    assert get_connection('http://example.com') is a
+
+    set_tor_port(False)
+    b = get_connection('http://example.com')
+    assert b is not a
+    assert not b.is_tor and not b.ses.proxies
+
+    set_tor_port(9999)
+    c = get_connection('http://example.com')
+    assert c.is_tor and c.ses.proxies['https'] == 'socks5h://127.0.0.1:9999'
+
+    # back to detection, and then Tor goes away
+    set_tor_port(None)
+    d = get_connection('http://example.com')
+    assert d is not c and d.is_tor
+    assert get_connection('http://example.com') is d
+
+    monkeypatch.setattr(sweep, 'probe_socks5', lambda p: False)
+    monkeypatch.setattr(time, 'monotonic', lambda real=time.monotonic: real() + sweep.TOR_CACHE_TTL)
+    e = get_connection('http://example.com')
+    assert e is not d and not e.is_tor
+
+def test_tor_not_socks():
+    # something else listening, like a web server
+    srv = socket.create_server(('127.0.0.1', 0))
+    port = srv.getsockname()[1]
+
+    def serve():
+        conn, _ = srv.accept()
+        with conn:
+            conn.recv(3)
+            conn.sendall(b'HTTP/1.0 400 Bad Request\r\n\r\n')
+
+    threading.Thread(target=serve, daemon=True).start()
+    assert not probe_socks5(port)
+    srv.close()
+
+@pytest.fixture
+def esplora():
+    # local HTTP stand-in for an Esplora server; yields (base url, list of paths requested)
+    TXID = 'ab' * 32
+    answers = {
+        f'/api/tx/{TXID}': dict(txid=TXID, status=dict(confirmed=True, block_height=10)),
+        f'/api/tx/{"cd"*32}': dict(txid='cd'*32, status=dict(confirmed=False)),
+        '/api/address/bc1qaddr/utxo': [dict(txid=TXID, vout=0, value=1234,
+                                            status=dict(confirmed=True, block_height=10))],
+        '/api/blocks/tip/height': 10,
+    }
+    hits = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            hits.append(self.path)
+            body = json.dumps(answers[self.path]).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *a):
+            pass
+
+    srv = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    set_tor_port(False)
+    yield 'http://127.0.0.1:%d' % srv.server_port, hits
+    set_tor_port(None)
+    srv.shutdown()
+    srv.server_close()
+
+def test_response_cache(esplora, tmp_path, monkeypatch, esplora_cache_dir):
+    server, hits = esplora
+    web = NetConnection(server, cache_dir=str(tmp_path))
+
+    paths = ['/api/tx/' + 'ab'*32, '/api/tx/' + 'cd'*32,
+                '/api/address/bc1qaddr/utxo', '/api/blocks/tip/height']
+    first = [web.get_json(p) for p in paths]
+    assert hits == paths
+
+    # confirmed txn and utxo set now cached, others are not; also shared with new connections
+    hits.clear()
+    web2 = NetConnection(server, cache_dir=str(tmp_path))
+    assert [web2.get_json(p) for p in paths] == first
+    assert hits == paths[1:2] + paths[3:]
+
+    # utxo set expires
+    hits.clear()
+    monkeypatch.setattr(time, 'time', lambda real=time.time: real() + sweep.UTXO_CACHE_TTL + 1)
+    ul = UTXOList('bc1qaddr', web=web)
+    ul.fetch()
+    assert ul.confirmed_balance() == 1234
+    assert ul.fetch_txns() == {'ab'*32: first[0]}
+    assert hits == paths[2:3]
+
+    # damaged entries are ignored
+    for fn in tmp_path.glob('*/*.json'):
+        fn.write_text('garbage')
+    hits.clear()
+    assert web.get_json(paths[0]) == first[0]
+    assert hits == paths[:1]
+
+    # tests use a temp dir, see conftest
+    assert get_connection().cache.path == esplora_cache_dir
+
+    # off unless configured
+    monkeypatch.setattr(sweep, 'CACHE_DIR', None)
+    assert NetConnection(server).cache is None
+
+    # can be disabled
+    hits.clear()
+    web3 = NetConnection(server, cache_dir=False)
+    web3.get_json(paths[0])
+    assert web3.cache is None
+    assert hits == paths[:1]
+
+class FakeHistory(NetConnection):
+    # Esplora address history with many small deposits, some spent, newest first
+    ADDR = 'bc1qbusy'
+
+    def __init__(self):
+        self.paths = []
+        txns = []
+        for i in range(60):
+            vin = [dict(txid='%064x' % (i+1000), vout=0, prevout=dict(scriptpubkey_address='bc1qother'))]
+            if i % 3 == 2:
+                # spend previous deposit
+                vin.append(dict(txid='%064x' % (i-1), vout=1,
+                                prevout=dict(scriptpubkey_address=self.ADDR)))
+            txns.append(dict(txid='%064x' % i, vin=vin,
+                        vout=[dict(scriptpubkey_address='bc1qother', value=1),
+                              dict(scriptpubkey_address=self.ADDR, value=1000+i)],
+                        status=dict(confirmed=True, block_height=100+i)))
+        self.chain = txns[::-1]
+
+        # unconfirmed chain, listed in the "wrong" order
+        m1 = dict(txid='aa'*32, vin=[dict(txid='%064x' % 59, vout=1,
+                                        prevout=dict(scriptpubkey_address=self.ADDR))],
+                    vout=[dict(scriptpubkey_address=self.ADDR, value=5)], status=dict(confirmed=False))
+        m2 = dict(txid='bb'*32, vin=[dict(txid='aa'*32, vout=0,
+                                        prevout=dict(scriptpubkey_address=self.ADDR))],
+                    vout=[dict(scriptpubkey_address=self.ADDR, value=4)], status=dict(confirmed=False))
+        self.mempool = [m1, m2]
+
+    def get_json(self, path, **kws):
+        import requests
+        self.paths.append(path)
+        base = f'/api/address/{self.ADDR}/'
+        assert path.startswith(base)
+        cmd = path[len(base):]
+        if cmd == 'utxo':
+            r = requests.Response()
+            r.status_code = 400
+            r.raise_for_status()
+        if cmd == 'txs/mempool':
+            return self.mempool
+        assert cmd.startswith('txs/chain')
+        pos = 0
+        if cmd != 'txs/chain':
+            last = cmd.split('/')[-1]
+            pos = [t['txid'] for t in self.chain].index(last) + 1
+        return self.chain[pos:pos+sweep.TXS_PAGE_SIZE]
+
+def test_history_utxos():
+    web = FakeHistory()
+    ul = UTXOList(web.ADDR, web=web)
+
+    # rejected by /utxo, so uses history instead
+    assert ul.fetch() == 40
+    assert web.paths[0].endswith('/utxo')
+    assert len(web.paths) == 1 + 1 + 3
+
+    expect = {('%064x' % i, 1) for i in range(60) if i % 3 != 1 and i != 59}
+    expect.add(('bb'*32, 0))
+    assert {(u.txid, u.vout) for u in ul.utxos} == expect
+    assert ul.unconfirmed_balance() == 4
+    assert ul.confirmed_balance() == sum(1000+int(t, 16) for t, _ in expect if t != 'bb'*32)
+    assert ul._spent == set()
+    assert ul.last_seen_txid == '%064x' % 0
+
+    # streaming
+    txids = [t['txid'] for t in ul.iter_history()]
+    assert txids == ['aa'*32, 'bb'*32] + ['%064x' % i for i in range(59, -1, -1)]
+    assert [t['txid'] for t in ul.iter_history('%064x' % 10)] == ['%064x' % i for i in range(9, -1, -1)]
+
+def test_history_resume(monkeypatch):
+    web = FakeHistory()
+    ul = UTXOList(web.ADDR, web=web)
+    ul.fetch_history()
+    expect = sorted(ul.utxos)
+
+    # network fails part way
+    real = web.get_json
+    def flakey(path, **kws):
+        if path.endswith('/' + web.chain[49]['txid']):
+            raise ConnectionError()
+        return real(path, **kws)
+    monkeypatch.setattr(web, 'get_json', flakey)
+
+    with pytest.raises(ConnectionError):
+        ul.fetch_history()
+    assert ul.last_seen_txid == web.chain[49]['txid']
+
+    monkeypatch.setattr(web, 'get_json', real)
+    web.paths.clear()
+    ul.fetch_history(resume=True)
+    assert len(web.paths) == 1
+    assert sorted(ul.utxos) == expect
+
 # EOF
@@ -0,0 +1,287 @@
+#
+# (c) Copyright 2022 by Coinkite Inc. This file is covered by license found in COPYING-CC.
+#
+# Reader discovery logic, using fake PC/SC readers: no hardware needed.
+#
+import sys, time, types, asyncio, threading
+import pytest
+from cktap import transport, aio
+from cktap.proto import CKTapCard
+from cktap.constants import CARD_ATR
+from cktap.transport import find_cards, find_first, CardMonitor
+
+class FakeCard(CKTapCard):
+    # stands in for CKTapCard, built on whatever the fake reader connected to
+    def __init__(self, conn):
+        self.name = conn.reader.name
+        self.closed = False
+        self.threads = {threading.current_thread()}
+
+    def close(self):
+        self.threads.add(threading.current_thread())
+        self.closed = True
+
+    def ping(self):
+        self.threads.add(threading.current_thread())
+        return self.name
+
+class FakeConn:
+    def __init__(self, reader):
+        self.reader = reader
+
+    def connect(self):
+        time.sleep(self.reader.delay)
+        if self.reader.error:
+            raise self.reader.error
+
+    def getATR(self):
+        return self.reader.atr
+
+    def disconnect(self):
+        self.reader.disconnected = True
+
+class FakeReader:
+    def __init__(self, name, delay=0, atr=CARD_ATR, error=None, card_error=None):
+        self.name = name
+        self.delay = delay
+        self.atr = atr
+        self.error = error              # from connect()
+        self.card_error = card_error    # from CKTapCard()
+
+    def createConnection(self):
+        return FakeConn(self)
+
+    def __str__(self):
+        return self.name
+
+class FakePCSCCard:
+    # what pyscard's monitor reports: a card on a reader
+    def __init__(self, reader):
+        self.reader = reader
+        self.atr = reader.atr
+
+    def createConnection(self):
+        return self.reader.createConnection()
+
+@pytest.fixture
+def fake_pcsc(monkeypatch):
+    # install fake smartcard modules; tests set .readers to the list of FakeReader
+    class CardConnectionException(Exception): pass
+    class NoCardException(Exception): pass
+
+    rv = types.SimpleNamespace(readers=[], cards=[], monitors=[])
+
+    class CardObserver:
+        pass
+
+    class PCSCMonitor:
+        # pyscard tells new observers about cards already present, then of changes
+        def __init__(self):
+            self.observers = []
+            rv.monitors.append(self)
+
+        def addObserver(self, observer):
+            self.observers.append(observer)
+            present = [FakePCSCCard(r) for r in rv.readers]
+            if present:
+                observer.update(self, (present, []))
+
+        def deleteObserver(self, observer):
+            self.observers.remove(observer)
+
+        def event(self, added=[], removed=[]):
+            # as from pyscard's monitor thread
+            added = [FakePCSCCard(r) for r in added]
+            removed = [FakePCSCCard(r) for r in removed]
+            for ob in self.observers:
+                ob.update(self, (added, removed))
+
+    top = types.ModuleType('smartcard')
+    system = types.ModuleType('smartcard.System')
+    system.readers = lambda: list(rv.readers)
+    excs = types.ModuleType('smartcard.Exceptions')
+    excs.CardConnectionException = CardConnectionException
+    excs.NoCardException = NoCardException
+    monitoring = types.ModuleType('smartcard.CardMonitoring')
+    monitoring.CardMonitor = PCSCMonitor
+    monitoring.CardObserver = CardObserver
+    top.System, top.Exceptions, top.CardMonitoring = system, excs, monitoring
+
+    for name, mod in [('smartcard', top), ('smartcard.System', system),
+                        ('smartcard.Exceptions', excs), ('smartcard.CardMonitoring', monitoring)]:
+        monkeypatch.setitem(sys.modules, name, mod)
+
+    def make_card(conn):
+        if conn.reader.card_error:
+            raise conn.reader.card_error
+        card = FakeCard(conn)
+        rv.cards.append(card)
+        return card
+
+    monkeypatch.setattr(transport.CKTapUnixTransport, 'find_simulator', lambda: None)
+    monkeypatch.setattr(transport, 'CKTapNFCTransport', lambda conn: conn)
+    monkeypatch.setattr(transport, 'CKTapCard', make_card)
+
+    return rv
+
+def names(cards):
+    return [c.name for c in cards]
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_find_cards_order(fake_pcsc, parallel):
+    fake_pcsc.readers = [FakeReader('slow', 0.3), FakeReader('fast', 0.05),
+                            FakeReader('other card', 0, atr=[1,2,3]),
+                            FakeReader('broken', 0, error=IOError('unplugged')),
+                            FakeReader('medium', 0.15)]
+
+    if parallel:
+        # fastest first, and total time is about that of slowest reader
+        start = time.monotonic()
+        assert names(find_cards(parallel=True)) == ['fast', 'medium', 'slow']
+        assert time.monotonic() - start < 0.45
+    else:
+        # reader order, and first error stops it
+        with pytest.raises(IOError):
+            names(find_cards())
+        fake_pcsc.readers.pop(3)
+        assert names(find_cards()) == ['slow', 'fast', 'medium']
+
+def test_find_cards_timeout(fake_pcsc):
+    fake_pcsc.readers = [FakeReader('a', 0.05), FakeReader('b', 0.3), FakeReader('c', 0.8)]
+
+    # caller is slow to consume cards, but that doesn't count against the timeout
+    got = []
+    for card in find_cards(parallel=True, timeout=0.5):
+        got.append(card)
+        time.sleep(0.6)
+
+    assert names(got) == ['a', 'b']
+    assert not any(c.closed for c in got)
+
+    # card found too late is released, once it shows up
+    time.sleep(0.5)
+    late, = [c for c in fake_pcsc.cards if c.name == 'c']
+    assert late.closed
+
+def test_find_first(fake_pcsc):
+    fake_pcsc.readers = [FakeReader('a', 0.1), FakeReader('b', 0.01),
+                            FakeReader('c', 0.2), FakeReader('d', 0.1)]
+
+    card = find_first(parallel=True)
+    assert card.name == 'b'
+    assert not card.closed
+
+    # all the others are closed, whenever they were found
+    time.sleep(0.4)
+    assert len(fake_pcsc.cards) == 4
+    assert all(c.closed for c in fake_pcsc.cards if c is not card)
+
+def test_no_readers(fake_pcsc):
+    with pytest.raises(RuntimeError):
+        find_first(parallel=True)
+
+def test_card_monitor(fake_pcsc):
+    a, b = FakeReader('a'), FakeReader('b')
+    bad = FakeReader('bad', card_error=AssertionError('first_look'))
+    pulled = FakeReader('pulled', card_error=RuntimeError('Bad CBOR from card'))
+    other = FakeReader('other card', atr=[1,2,3])
+    fake_pcsc.readers = [a]
+
+    inserted, removed = [], []
+    with CardMonitor(on_insert=inserted.append, on_remove=removed.append) as mon:
+        # already present
+        assert names(inserted) == ['a']
+        assert mon.wait_for_card(timeout=0).name == 'a'
+        assert mon.wait_for_card(timeout=0.1) is None
+
+        pcsc, = fake_pcsc.monitors
+
+        # broken cards in the same batch don't stop the good one
+        pcsc.event(added=[bad, pulled, other, b])
+        assert names(inserted) == ['a', 'b']
+        assert bad.disconnected and pulled.disconnected
+        assert sorted(mon.cards) == ['a', 'b']
+
+        assert mon.wait_for_card(timeout=0).name == 'b'
+
+        # waiting from another thread
+        got = []
+        t = threading.Thread(target=lambda: got.append(mon.wait_for_card(timeout=2)))
+        t.start()
+        time.sleep(0.1)
+        assert got == []
+        c = FakeReader('c')
+        pcsc.event(added=[c])
+        t.join()
+        assert names(got) == ['c']
+
+        # removal closes card, and removed cards are not handed out
+        pcsc.event(removed=[a])
+        assert names(removed) == ['a']
+        assert removed[0].closed
+        assert 'a' not in mon.cards
+
+        d = FakeReader('d')
+        pcsc.event(added=[d])
+        pcsc.event(removed=[d])
+        assert mon.wait_for_card(timeout=0.1) is None
+
+        # errors from callbacks don't escape into pyscard either
+        mon.on_insert = lambda card: 1/0
+        pcsc.event(added=[FakeReader('e')])
+        assert 'e' in mon.cards
+
+    # stopped: observer gone and remaining cards closed
+    assert pcsc.observers == []
+    assert names(removed) == ['a', 'd', 'b', 'c', 'e']
+    assert all(c.closed for c in fake_pcsc.cards)
+    assert mon.cards == {}
+
+def test_aio_find_cards(fake_pcsc):
+    fake_pcsc.readers = [FakeReader('slow', 0.3), FakeReader('fast', 0.05),
+                            FakeReader('broken', 0, card_error=AssertionError('first_look')),
+                            FakeReader('medium', 0.15), FakeReader('late', 0.8)]
+
+    async def doit():
+        cards = await aio.find_cards(parallel=True, timeout=0.5)
+        assert [c.name for c in cards] == ['fast', 'medium', 'slow']
+        for c in cards:
+            assert await c.ping() == c.name
+            await c.close()
+
+        first = await aio.find_first(parallel=True)
+        assert first.name == 'fast'
+        card = await first.detach()
+        assert isinstance(card, FakeCard) and not card.closed
+
+        await asyncio.sleep(1)
+
+    asyncio.run(doit())
+
+    # every card was made, used and closed by just one thread, its own
+    threads = [c.threads for c in fake_pcsc.cards]
+    assert all(len(t) == 1 for t in threads)
+    assert len(set.union(*threads)) == len(fake_pcsc.cards)
+    assert threading.main_thread() not in set.union(*threads)
+
+    # ... and those found late, or not wanted, are closed
+    assert [c.name for c in fake_pcsc.cards if not c.closed] == ['fast']
+
+@pytest.mark.parametrize('parallel', [False, True])
+def test_aio_cancelled(fake_pcsc, parallel):
+    # scan cancelled while readers are still busy: cards found later are still closed
+    fake_pcsc.readers = [FakeReader('a', 0.3), FakeReader('b', 0.4)]
+
+    async def doit():
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(aio.find_cards(parallel=parallel), 0.1)
+
+    asyncio.run(doit())
+    time.sleep(0.6)
+
+    assert names(fake_pcsc.cards) == (['a', 'b'] if parallel else ['a'])
+    assert all(c.closed for c in fake_pcsc.cards)
+    assert all(len(c.threads) == 1 for c in fake_pcsc.cards)
+    assert not [t for t in threading.enumerate() if t.name.startswith('cktap-')]
+
+# EOF